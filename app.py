@@ -2,12 +2,20 @@ import streamlit as st
 import streamlit.components.v1 as components
 import yaml
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import time
 import graphviz
+import plotly.graph_objects as go
 import tempfile
 
+from simulation.absorbing import absorbed_step
+from simulation.compiled_model import compile_config, patch_model
+from simulation.jobs import forget_job, get_job, submit_job
+from simulation.simulation_engine import simulate_model
+from utils.frame_limiter import DEFAULT_MAX_FPS, FrameLimiter
+
 # ─── Temporary directories for configs & results ─────────────────────────────
 if "tmpdir_obj" not in st.session_state:
     st.session_state.tmpdir_obj = tempfile.TemporaryDirectory(prefix="simpact-")
@@ -33,6 +41,8 @@ _init('prev_initial',      st.session_state.initial_state)
 _init('transitions_list',  [{"source": st.session_state.initial_state,
                              "target": "Dead", "probability": 1.0}])
 _init('timestep_unit',     "Week")
+_init('draw_extra_config', {})                               # config keys not edited here (costs, utilities, ...)
+_init('live_preview_steps', 20)
 
 # Simulation-tab state
 _init('loaded_name',       "")
@@ -41,6 +51,10 @@ _init('sim_transitions',   list(st.session_state.transitions_list))
 _init('sim_initial_patients', st.session_state.draw_num_patients)
 _init('sim_timestep_unit', st.session_state.timestep_unit)
 _init('sim_results_df',    None)
+_init('sim_results_file',  "")
+_init('sim_playback',      None)                             # cached trace the animation replays
+_init('sim_play_pending',  False)
+_init('sim_job_id',        None)                             # background run of this session, if any
 _init('custom_result_name',"")
 _init('uploaded_parsed_config', None)
 
@@ -72,14 +86,176 @@ def list_results():
 def load_results_file(name):
     return pd.read_csv(os.path.join(RESULTS_DIR, name))
 
+def trace_frame(trace, states, unit):
+    """Builds the results DataFrame once from a (steps, states) trace; the step unit is kept in attrs."""
+    history = pd.DataFrame(trace, columns=states, copy=False)  # wraps the trace without copying it
+    history.insert(0, 'Step', np.arange(len(trace)))
+    history.attrs["timestep_unit"] = unit
+    return history
+
+def state_graph(playback, counts):
+    dot = graphviz.Digraph(graph_attr={'rankdir':'LR'},
+                           node_attr={'shape':'ellipse'})
+    dot.node('Start','Start')
+    for c, n in zip(playback["states"], counts.tolist()):
+        dot.node(c, f"{c}\n({n} patients)")
+    dot.edge('Start', playback["initial_state"], label=str(playback["initial"]))
+    for tr in playback["transitions"]:
+        dot.edge(tr['source'], tr['target'], label=str(tr['probability']))
+    return dot
+
+# Longer runs are sampled evenly (always keeping the last step) to bound the figure size
+PLOTLY_MAX_FRAMES = 1000
+
+def collect_simulation_job():
+    """Picks up this session's background run once it has finished: saves results and sets up playback."""
+    job_id = st.session_state.sim_job_id
+    job = get_job(job_id) if job_id else None
+    if job is not None and job.running:
+        return
+    st.session_state.sim_job_id = None
+    if job is None:
+        if job_id:
+            st.warning("The simulation run could not be found (the server may have restarted); please start it again.")
+        return
+    forget_job(job_id)
+    if job.status == "cancelled":
+        st.warning(f"Simulation cancelled after {job.steps_done} of {job.num_steps} steps.")
+        return
+    if job.status == "failed":
+        st.error(f"Simulation failed: {job.error}")
+        return
+
+    meta = job.meta
+    _, trace = job.result
+    # stop animating once nobody is left outside the absorbing states
+    converged = absorbed_step(trace, job.model.absorbing_states(), 0.5)
+    if converged is not None and meta["truncate"]:
+        trace = trace[:converged+1]
+
+    # built once from the trace, with integer steps and the unit as metadata;
+    # results are saved before any animation, so they are available at once
+    history = trace_frame(trace, job.model.states, meta["unit"])
+    st.session_state.sim_results_df = history
+    st.session_state.sim_results_file = save_results(history, prefix=meta["prefix"])
+
+    st.session_state.sim_playback = {
+        "trace": trace,
+        "states": job.model.states,
+        "transitions": job.model.transitions,
+        "initial_state": meta["initial_state"],
+        "initial": meta["initial"],
+        "unit": meta["unit"],
+        "converged": converged,
+        "animate_to": len(trace) - 1 if converged is None else converged,
+    }
+    st.session_state.sim_play_pending = meta["animate"]
+
+@st.fragment(run_every=0.5)
+def simulation_job_progress():
+    """Polls the running job without rerunning the page; reruns the app once it has finished."""
+    job = get_job(st.session_state.sim_job_id) if st.session_state.sim_job_id else None
+    if job is None or not job.running:
+        st.rerun()
+    st.progress(job.progress, text=f"Simulating… step {job.steps_done}/{job.num_steps}")
+    if st.button("Cancel", key="sim_cancel"):
+        job.cancel()
+
+def playback_figure(playback, frame_ms):
+    """
+    Animated Plotly bar chart of the cached trace. Every frame is shipped to the browser once,
+    so play, pause and scrubbing run client-side without rerunning the script.
+    """
+    trace = playback["trace"]
+    last = len(trace) - 1
+    steps = np.unique(np.linspace(0, last, min(last+1, PLOTLY_MAX_FRAMES)).round().astype(int))
+    states = playback["states"]
+    frames = [go.Frame(data=[go.Bar(x=states, y=trace[i].tolist())], name=str(i)) for i in steps]
+    fig = go.Figure(data=[go.Bar(x=states, y=trace[0].tolist())], frames=frames)
+    fig.update_layout(
+        yaxis={'range': [0, max(1, int(trace.max())) * 1.05], 'title': "Patients"},
+        updatemenus=[{
+            'type': "buttons", 'showactive': False,
+            'buttons': [
+                {'label': "▶ Play", 'method': "animate",
+                 'args': [None, {'frame': {'duration': frame_ms, 'redraw': True},
+                                 'transition': {'duration': 0}, 'fromcurrent': True}]},
+                {'label': "⏸ Pause", 'method': "animate",
+                 'args': [[None], {'frame': {'duration': 0, 'redraw': False}, 'mode': "immediate"}]},
+            ],
+        }],
+        sliders=[{
+            'currentvalue': {'prefix': f"{playback['unit']} "},
+            'steps': [{'label': str(i), 'method': "animate",
+                       'args': [[str(i)], {'frame': {'duration': 0, 'redraw': True}, 'mode': "immediate"}]}
+                      for i in steps],
+        }],
+    )
+    return fig
+
+def play_trace(playback, animate, speed, max_fps=DEFAULT_MAX_FPS):
+    """
+    Replays a computed run from its cached trace, or just shows its final state.
+    Redraws are capped at max_fps; steps in between are skipped, never the final one.
+    """
+    trace = playback["trace"]
+    last = len(trace) - 1
+    prog = st.progress(0)
+    stat = st.empty()
+    graph = st.empty()
+
+    def render(i):
+        prog.progress(i/max(last, 1))
+        stat.text(f"Step {i}/{last}")
+        graph.graphviz_chart(state_graph(playback, trace[i]), use_container_width=True)
+
+    limiter = FrameLimiter(render, max_fps)
+    steps = range(1, playback["animate_to"]+1) if animate else range(0)
+    # any widget interaction reruns the script, which stops a playback midway
+    for i in steps:
+        limiter.offer(i)
+        time.sleep(speed)
+    limiter.offer(last)
+    limiter.flush()
+    if limiter.dropped:
+        st.caption(f"Drew {limiter.rendered} of {len(steps) + 1} frames; "
+                   f"{limiter.dropped} were skipped to stay within {max_fps} fps.")
+
 # ─── Callbacks ──────────────────────────────────────────────────────────────
 
+# Keys the Draw tab edits directly; anything else in a config is carried through untouched
+DRAW_CONFIG_KEYS = {'model_name', 'initial_patients', 'initial_state', 'transitions', 'timestep_unit'}
+
+def extra_config_fields(cfg):
+    return {k: v for k, v in cfg.items() if k not in DRAW_CONFIG_KEYS}
+
+def current_draw_config():
+    return {
+      **st.session_state.draw_extra_config,
+      "model_name":      st.session_state.draw_model_name,
+      "initial_patients":st.session_state.draw_num_patients,
+      "initial_state":   st.session_state.initial_state,
+      "transitions":     st.session_state.transitions_list,
+      "timestep_unit":   st.session_state.timestep_unit
+    }
+
 def toggle_left():
     st.session_state.show_left = not st.session_state.show_left
 
 def toggle_right():
     st.session_state.show_right = not st.session_state.show_right
 
+def set_transition_field(i, field, key):
+    tl = st.session_state.transitions_list
+    tl[i] = {**tl[i], field: st.session_state[key]}
+
+def on_probability_change(i):
+    # Patch the cached compiled model in place of a full recompile, so the live
+    # preview on the rerun only re-simulates
+    old_model = compile_config(current_draw_config())
+    set_transition_field(i, 'probability', f"p{i}")
+    patch_model(old_model, st.session_state.transitions_list, i)
+
 def add_transition():
     st.session_state.transitions_list.append({"source":"", "target":"", "probability":0.0})
 
@@ -115,6 +291,7 @@ def apply_uploaded_config():
     st.session_state.prev_initial       = st.session_state.initial_state
     st.session_state.transitions_list   = cfg.get('transitions',      st.session_state.transitions_list)
     st.session_state.timestep_unit      = cfg.get('timestep_unit',    st.session_state.timestep_unit)
+    st.session_state.draw_extra_config  = extra_config_fields(cfg)
     st.success("Applied uploaded config.")
 
 def apply_draw_config():
@@ -128,6 +305,7 @@ def apply_draw_config():
     st.session_state.prev_initial       = st.session_state.initial_state
     st.session_state.transitions_list   = cfg.get('transitions',      st.session_state.transitions_list)
     st.session_state.timestep_unit      = cfg.get('timestep_unit',    st.session_state.timestep_unit)
+    st.session_state.draw_extra_config  = extra_config_fields(cfg)
     st.success(f"Loaded '{name}' into Draw tab.")
 
 def load_simulation_config():
@@ -141,6 +319,7 @@ def load_simulation_config():
     st.session_state.sim_initial_patients = cfg.get('initial_patients',  st.session_state.draw_num_patients)
     st.session_state.sim_timestep_unit    = cfg.get('timestep_unit',     st.session_state.timestep_unit)
     st.session_state.loaded_name          = sel
+    st.session_state.sim_playback         = None      # the last run belongs to the previous config
     st.success(f"Loaded '{sel}' for simulation.")
 
 # ─── Layout ─────────────────────────────────────────────────────────────────
@@ -155,15 +334,12 @@ if page == "Draw":
         "graph TD",
         f"    Start -- [{st.session_state.draw_num_patients}] --> {st.session_state.initial_state};"
     ]
-    probs = {}
     for t in st.session_state.transitions_list:
         s,tgt,p = t['source'], t['target'], t['probability']
         if not s or not tgt:
             continue
         lbl = f" -- [{p}] -->" if isinstance(p,(int,float)) else " -->"
         mer_lines.append(f"    {s}{lbl} {tgt};")
-        if isinstance(p,(int,float)):
-            probs.setdefault(s, []).append(p)
     mer_code = "\n".join(mer_lines)
 
     # — Toggle buttons
@@ -201,14 +377,7 @@ if page == "Draw":
                 csave, cload = st.columns([2,1])
                 with cload:
                     if st.button("Save Config") and st.session_state.save_config_name:
-                        cfg = {
-                          "model_name":      st.session_state.draw_model_name,
-                          "initial_patients":st.session_state.draw_num_patients,
-                          "initial_state":   st.session_state.initial_state,
-                          "transitions":     st.session_state.transitions_list,
-                          "timestep_unit":   st.session_state.timestep_unit
-                        }
-                        save_config_file(st.session_state.save_config_name, cfg)
+                        save_config_file(st.session_state.save_config_name, current_draw_config())
 
                 st.selectbox("Load Config", options=[""]+list_configs(), key="load_config_draw")
                 st.button("Apply Config", on_click=apply_draw_config)
@@ -238,10 +407,10 @@ if page == "Draw":
                     c1, c2, c3 = st.columns([1,1,1])
                     with c1:
                         st.text_input("Source", value=t['source'], key=f"s{i}",
-                                      on_change=lambda i=i: st.session_state.transitions_list.__setitem__(i, {**t, 'source': st.session_state[f"s{i}"]}))
+                                      on_change=set_transition_field, args=(i, 'source', f"s{i}"))
                     with c2:
                         st.text_input("Target", value=t['target'], key=f"t{i}",
-                                      on_change=lambda i=i: st.session_state.transitions_list.__setitem__(i, {**t, 'target': st.session_state[f"t{i}"]}))
+                                      on_change=set_transition_field, args=(i, 'target', f"t{i}"))
                     with c3:
                         st.number_input("Probability",
                                         value=t['probability'],
@@ -250,31 +419,32 @@ if page == "Draw":
                                         step=0.01,
                                         format="%.2f",
                                         key=f"p{i}",
-                                        on_change=lambda i=i: st.session_state.transitions_list.__setitem__(i, {**t, 'probability': st.session_state[f"p{i}"]}))
+                                        on_change=on_probability_change, args=(i,))
                 cadd, crem = st.columns([0.5,0.5])
                 with cadd: st.button("➕ Add Transition", on_click=add_transition)
                 with crem: st.button("➖ Remove Last",   on_click=remove_transition)
 
                 st.markdown("---")
-                bad = False
-                for s, ps in probs.items():
-                    if abs(sum(ps)-1.0) > 1e-6:
-                        st.warning(f"Outgoing from '{s}' sum to {sum(ps):.2f}, not 1.0.")
-                        bad = True
-                if not bad:
+                draw_model = compile_config(current_draw_config())
+                for problem in draw_model.problems:
+                    st.warning(problem)
+                if draw_model.is_valid:
                     st.success("All probabilities sum to 1.0.")
 
+                # Live mini-trajectory, re-simulated on every edit from the patched compiled model
+                st.markdown("---")
+                st.number_input("Live Preview Steps", min_value=1, max_value=500, key="live_preview_steps")
+                if st.session_state.initial_state in draw_model.state_index:
+                    _, live_trace = simulate_model(draw_model,
+                                                   {st.session_state.initial_state: st.session_state.draw_num_patients},
+                                                   st.session_state.live_preview_steps,
+                                                   mode="integer", use_cache=False)
+                    st.line_chart(pd.DataFrame(live_trace, columns=draw_model.states), height=220)
+
             # YAML
             with tabC:
                 st.subheader("📄 Diagram Data in YAML Format")
-                cur = {
-                  "model_name":      st.session_state.draw_model_name,
-                  "initial_patients":st.session_state.draw_num_patients,
-                  "initial_state":   st.session_state.initial_state,
-                  "transitions":     st.session_state.transitions_list,
-                  "timestep_unit":   st.session_state.timestep_unit
-                }
-                st.code(yaml.dump(cur), language="yaml", height=300)
+                st.code(yaml.dump(current_draw_config()), language="yaml", height=300)
 
     # — Mermaid live preview (centered) ────────────────────────────────────────
     if st.session_state.show_right:
@@ -311,6 +481,8 @@ if page == "Draw":
 elif page == "Simulate":
 
     st.header("🔬 Run Simulation")
+    # a finished background run lands in every tab, including Results
+    collect_simulation_job()
     tab1, tab2, tab3 = st.tabs(["Load Config","Run Simulation","Results"])
 
     # — Tab 1: Load a saved config into simulation-only state
@@ -344,62 +516,67 @@ elif page == "Simulate":
                 key="run_sim_unit"
             )
 
-            if st.button("Start Simulation"):
+            st.checkbox("Stop the run once everyone is absorbed", key="run_sim_truncate")
+            st.checkbox("Animate the run after computing it", value=True, key="run_sim_animate")
+            st.radio("Playback", ["Diagram (server)", "In browser (Plotly)"], horizontal=True,
+                     key="run_sim_playback")
+            st.slider("Max animation frames per second", 1, 30, DEFAULT_MAX_FPS, key="run_sim_fps")
+
+            if st.button("Start Simulation", disabled=st.session_state.sim_job_id is not None):
                 # ALWAYS read from sim_*:
                 initial_state = st.session_state.sim_initial_state
                 transitions   = st.session_state.sim_transitions
 
-                # build node set
-                nodes = {t['source'] for t in transitions} | {t['target'] for t in transitions}
-                nodes.add(initial_state)
-
-                # initialize counts
-                current = {n:0 for n in nodes}
-                current[initial_state] = sim_initial
-
-                # history DataFrame
-                cols = sorted(current)
-                history = pd.DataFrame(columns=['Step'] + cols)
-                history.loc[0] = [f"{sim_unit} 0"] + [current[c] for c in cols]
-
-                prog = st.progress(0)
-                stat = st.empty()
-                graph = st.empty()
-
-                for i in range(1, sim_steps+1):
-                    infl = {c:0 for c in cols}
-                    out = {c:0 for c in cols}
-                    for tr in transitions:
-                        m = round(current[tr['source']] * tr['probability'])
-                        out[tr['source']] += m
-                        infl[tr['target']] += m
-                    for c in cols:
-                        current[c] = max(0, current[c] + infl[c] - out[c])
-
-                    history.loc[i] = [f"{sim_unit} {i}"] + [current[c] for c in cols]
-                    prog.progress(i/sim_steps)
-                    stat.text(f"Step {i}/{sim_steps}")
-
-                    dot = graphviz.Digraph(graph_attr={'rankdir':'LR'},
-                                            node_attr={'shape':'ellipse'})
-                    dot.node('Start','Start')
-                    for c in cols:
-                        dot.node(c, f"{c}\n({current[c]} patients)")
-                    dot.edge('Start', initial_state, label=str(sim_initial))
-                    for tr in transitions:
-                        dot.edge(tr['source'], tr['target'], label=str(tr['probability']))
-                    graph.graphviz_chart(dot, use_container_width=True)
-
-                    time.sleep(sim_speed)
-
-                st.session_state.sim_results_df = history
-                prefix = (st.session_state.custom_result_name.strip() or "simulation_results")
-                save_results(history, prefix=prefix)
+                # compiled once per distinct config and reused across reruns
+                model = compile_config({"transitions": transitions, "initial_state": initial_state})
+                # runs on a background thread, so the page stays usable and the run can be cancelled;
+                # whole patients move along each edge and the cohort size never drifts
+                job = submit_job(model, {initial_state: sim_initial}, sim_steps, mode="integer", meta={
+                    "initial_state": initial_state,
+                    "initial": sim_initial,
+                    "unit": sim_unit,
+                    "truncate": st.session_state.run_sim_truncate,
+                    "animate": st.session_state.run_sim_animate,
+                    "prefix": st.session_state.custom_result_name.strip() or "simulation_results",
+                })
+                st.session_state.sim_job_id = job.job_id
+                st.session_state.sim_playback = None
+                st.rerun()
+
+            if st.session_state.sim_job_id is not None:
+                simulation_job_progress()
+
+            playback = st.session_state.sim_playback
+            if playback is not None:
+                if playback["converged"] is not None:
+                    st.info(f"Everyone reached an absorbing state at {playback['unit']} {playback['converged']}.")
+                st.download_button("Download Results",
+                                   data=st.session_state.sim_results_df.to_csv(index=False).encode(),
+                                   file_name=st.session_state.sim_results_file,
+                                   mime="text/csv",
+                                   key="sim_download_now")
+                if st.session_state.run_sim_playback == "In browser (Plotly)":
+                    # no server round-trips per frame; the speed slider sets the frame duration
+                    st.plotly_chart(playback_figure(playback, max(50, int(sim_speed * 1000))),
+                                    use_container_width=True)
+                else:
+                    play_col, skip_col = st.columns(2)
+                    if play_col.button("▶ Replay", key="sim_replay"):
+                        st.session_state.sim_play_pending = True
+                    skip_col.button("⏭ Skip to End", key="sim_skip")
+
+                    # cleared before playing, so a rerun that interrupts playback does not restart it
+                    animate = st.session_state.sim_play_pending
+                    st.session_state.sim_play_pending = False
+                    play_trace(playback, animate, sim_speed, st.session_state.run_sim_fps)
 
     # — Tab 3: view or load past results
     with tab3:
         st.subheader("📄 Simulation Results")
         if st.session_state.sim_results_df is not None:
+            unit = st.session_state.sim_results_df.attrs.get("timestep_unit")
+            if unit:
+                st.caption(f"Steps are in {unit.lower()}s.")
             st.dataframe(st.session_state.sim_results_df, use_container_width=True)
             csv = st.session_state.sim_results_df.to_csv(index=False).encode()
             st.download_button("Download Current Results",
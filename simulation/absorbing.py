@@ -0,0 +1,245 @@
+# simulation/absorbing.py
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from simulation.compiled_model import compile_model
+from simulation.sparse_matrix import CSRMatrix
+from simulation.transition_matrix import advance_cohort
+
+# Above this many transient states, sparse models are solved iteratively instead of densely
+DENSE_SOLVE_MAX_STATES = 2000
+ITERATIVE_TOLERANCE = 1e-10
+ITERATIVE_MAX_ITERATIONS = 10000
+# Steps advanced between convergence checks in advance_until_absorbed
+ABSORPTION_CHECK_EVERY = 32
+
+def _entries(matrix):
+    if isinstance(matrix, np.ndarray):
+        rows, cols = np.nonzero(matrix)
+        return rows, cols, matrix[rows, cols]
+    return matrix.coo()
+
+def absorbing_states(matrix, tol=1e-12):
+    """Returns a boolean mask of states that keep all of their mass (P[i, i] == 1)."""
+    rows, cols, values = _entries(matrix)
+    diagonal = np.zeros(matrix.shape[0])
+    on_diagonal = rows == cols
+    diagonal[rows[on_diagonal]] = values[on_diagonal]
+    return np.abs(diagonal - 1.0) <= tol
+
+def absorbed_step(trace, absorbing, tol):
+    """First row of trace whose mass outside the absorbing states is at most tol, or None."""
+    outside = trace[:, ~absorbing].sum(axis=1)
+    hits = np.flatnonzero(outside <= tol)
+    return int(hits[0]) if hits.size else None
+
+def advance_until_absorbed(matrix, initial_vector, num_steps, absorbing, tol=0.5, truncate=False,
+                           round_counts=True, schedule=None, check_every=ABSORPTION_CHECK_EVERY, integer=False):
+    """
+    advance_cohort that stops once the mass outside the absorbing states falls to tol or below.
+    absorbing: boolean state mask, e.g. CompiledModel.absorbing_states().
+    Convergence is checked every check_every steps on the whole chunk at once. The remaining
+    rows are then filled in bulk with the converged state, or dropped if truncate is set.
+    The default tol of half a person is exact for rounded counts: nobody is left to move.
+    integer: Allocate whole people instead of rounding each state (see advance_cohort).
+    Returns (trace, converged_step), with converged_step None if the run never converged.
+    """
+    if not absorbing.any():
+        return advance_cohort(matrix, initial_vector, num_steps, round_counts, schedule, integer), None
+    trace = np.empty((num_steps + 1, matrix.shape[0]))
+    trace[0] = np.rint(initial_vector) if integer else initial_vector
+    step = 0
+    converged = absorbed_step(trace[:1], absorbing, tol)
+    while converged is None and step < num_steps:
+        chunk = min(check_every, num_steps - step)
+        chunk_schedule = None if schedule is None else (schedule[0], schedule[1][step:])
+        trace[step:step + chunk + 1] = advance_cohort(matrix, trace[step], chunk, round_counts, chunk_schedule, integer)
+        done = absorbed_step(trace[step + 1:step + chunk + 1], absorbing, tol)
+        if done is not None:
+            converged = step + 1 + done
+        step += chunk
+    if converged is None:
+        return trace, None
+    if truncate:
+        return trace[:converged + 1], converged
+    trace[converged + 1:] = trace[converged]
+    return trace, converged
+
+def _adjacency(keys, others, n):
+    """Per-key neighbour lists: neighbours[k] holds the `others` entries whose key is k."""
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(keys, minlength=n)))).tolist()
+    flat = others[np.argsort(keys, kind="stable")].tolist()
+    return [flat[bounds[k]:bounds[k + 1]] for k in range(n)]
+
+def _reaches(rows, cols, targets):
+    """States with a path of non-zero transitions into the `targets` mask (BFS over reversed edges)."""
+    predecessors = _adjacency(cols, rows, targets.size)
+    reach = targets.tolist()
+    queue = deque(np.flatnonzero(targets).tolist())
+    while queue:
+        for state in predecessors[queue.popleft()]:
+            if not reach[state]:
+                reach[state] = True
+                queue.append(state)
+    return np.array(reach, dtype=bool)
+
+def _topological_order(rows, cols, n):
+    """
+    Orders states so that for every edge row -> col (self-loops ignored) col comes before row.
+    Returns None if the edges contain a cycle.
+    """
+    off_diagonal = rows != cols
+    rows, cols = rows[off_diagonal], cols[off_diagonal]
+    predecessors = _adjacency(cols, rows, n)
+    pending = np.bincount(rows, minlength=n).tolist()  # successors not yet placed
+    order = [state for state in range(n) if not pending[state]]
+    for state in order:  # order grows while it is walked, like a queue
+        for predecessor in predecessors[state]:
+            pending[predecessor] -= 1
+            if not pending[predecessor]:
+                order.append(predecessor)
+    return order if len(order) == n else None
+
+def _solve_acyclic(rows, cols, values, diagonal, rhs, order):
+    """
+    Solves (I - Q) x = rhs by back-substitution for an acyclic Q (self-loops allowed),
+    visiting states in topological order: x_i = (rhs_i + sum_j Q_ij x_j) / (1 - Q_ii).
+    """
+    off_diagonal = rows != cols
+    n = rhs.size
+    successors = _adjacency(rows[off_diagonal], cols[off_diagonal], n)
+    weights = _adjacency(rows[off_diagonal], values[off_diagonal], n)
+    rhs, diagonal = rhs.tolist(), diagonal.tolist()
+    x = [0.0] * n
+    for state in order:
+        inflow = sum(weight * x[j] for j, weight in zip(successors[state], weights[state]))
+        x[state] = (rhs[state] + inflow) / (1.0 - diagonal[state])
+    return np.array(x)
+
+def _solve_bicgstab(apply_q, rhs, q_diagonal, max_iterations=ITERATIVE_MAX_ITERATIONS):
+    """
+    Solves (I - Q) x = rhs with Jacobi-preconditioned BiCGSTAB, where apply_q(x) is Q x.
+    Unlike the Neumann series its iteration count does not blow up when absorption is slow.
+    Returns None if it does not reach ITERATIVE_TOLERANCE (relative residual) in max_iterations.
+    """
+    inverse_diagonal = 1.0 / (1.0 - q_diagonal)
+
+    def apply_a(x):
+        return x - apply_q(x)
+
+    x = np.zeros_like(rhs)
+    rhs_norm = np.linalg.norm(rhs)
+    if rhs_norm == 0.0:
+        return x
+    r = rhs.copy()
+    # A dense shadow residual; rhs itself is often one-hot (a single starting state), and its
+    # inner products with the residual then collapse to one entry and break the iteration down
+    r_hat = np.random.default_rng(0).random(rhs.size)
+    p = v = np.zeros_like(rhs)
+    rho = alpha = omega = 1.0
+    for _ in range(max_iterations):
+        rho_next = r_hat @ r
+        if rho_next == 0.0 or omega == 0.0:
+            return None  # breakdown
+        p = r + (rho_next / rho) * (alpha / omega) * (p - omega * v)
+        rho = rho_next
+        p_hat = inverse_diagonal * p
+        v = apply_a(p_hat)
+        alpha = rho / (r_hat @ v)
+        s = r - alpha * v
+        if np.linalg.norm(s) <= ITERATIVE_TOLERANCE * rhs_norm:
+            return x + alpha * p_hat
+        s_hat = inverse_diagonal * s
+        t = apply_a(s_hat)
+        omega = (t @ s) / (t @ t)
+        x = x + alpha * p_hat + omega * s_hat
+        r = s - omega * t
+        if np.linalg.norm(r) <= ITERATIVE_TOLERANCE * rhs_norm:
+            return x
+    return None
+
+def absorbing_analysis(matrix, states, initial_vector):
+    """
+    Solves the absorbing chain analytically with the fundamental matrix N = (I - Q)^-1,
+    using linear solves rather than an explicit inverse. Large sparse models are never densified:
+    acyclic chains (e.g. tunnel states) are solved exactly by back-substitution, others with
+    BiCGSTAB, raising ValueError if it does not converge.
+    Returns a dict with:
+      absorbing_states: list of absorbing state names,
+      expected_time: Series of expected cycles each person spends in each transient state,
+      life_expectancy: expected cycles per person before absorption,
+      absorption_probabilities: Series of the probability of ending in each absorbing state,
+      time_to_absorption: Series of expected cycles to absorption from each transient state.
+    """
+    absorbing = absorbing_states(matrix)
+    if not absorbing.any():
+        raise ValueError("The model has no absorbing states.")
+    rows, cols, values = _entries(matrix)
+    # CSR operators may store explicit zeros; those are not edges
+    nonzero = values != 0
+    rows, cols, values = rows[nonzero], cols[nonzero], values[nonzero]
+    if not _reaches(rows, cols, absorbing).all():
+        raise ValueError("Some states can never reach an absorbing state.")
+
+    transient = np.flatnonzero(~absorbing)
+    absorbing_idx = np.flatnonzero(absorbing)
+    local = np.full(len(states), -1)
+    local[transient] = np.arange(transient.size)
+    local[absorbing_idx] = np.arange(absorbing_idx.size)
+
+    from_transient = ~absorbing[rows]
+    q_mask = from_transient & ~absorbing[cols]
+    r_mask = from_transient & absorbing[cols]
+    R = np.zeros((transient.size, absorbing_idx.size))
+    np.add.at(R, (local[rows[r_mask]], local[cols[r_mask]]), values[r_mask])
+
+    start = np.asarray(initial_vector, dtype=float)[transient]
+    total = np.asarray(initial_vector, dtype=float).sum()
+    start = start / total if total else start
+    ones = np.ones(transient.size)
+
+    expected_time = time_to_absorption = None
+    if not isinstance(matrix, np.ndarray) and transient.size > DENSE_SOLVE_MAX_STATES:
+        q_rows, q_cols, q_values = local[rows[q_mask]], local[cols[q_mask]], values[q_mask]
+        Q = CSRMatrix.from_coo(q_rows, q_cols, q_values, (transient.size, transient.size))
+        q_diagonal = np.zeros(transient.size)
+        np.add.at(q_diagonal, q_rows[q_rows == q_cols], q_values[q_rows == q_cols])
+        order = _topological_order(q_rows, q_cols, transient.size)
+        if order is not None:
+            # y (I - Q) = start is the transposed system, solved in the reverse order
+            expected_time = _solve_acyclic(q_cols, q_rows, q_values, q_diagonal, start, order[::-1])
+            time_to_absorption = _solve_acyclic(q_rows, q_cols, q_values, q_diagonal, ones, order)
+        else:
+            # Krylov methods may need about as many iterations as there are states
+            max_iterations = max(ITERATIVE_MAX_ITERATIONS, 2 * transient.size)
+            expected_time = _solve_bicgstab(Q.vecmat, start, q_diagonal, max_iterations)         # start @ N
+            time_to_absorption = _solve_bicgstab(Q.matvec, ones, q_diagonal, max_iterations)     # N @ 1
+        if expected_time is None or time_to_absorption is None:
+            raise ValueError(f"The iterative solver did not converge for {transient.size} transient states; "
+                             f"a dense solve is only attempted up to {DENSE_SOLVE_MAX_STATES}.")
+    else:
+        I_minus_Q = np.eye(transient.size)
+        np.add.at(I_minus_Q, (local[rows[q_mask]], local[cols[q_mask]]), -values[q_mask])
+        expected_time = np.linalg.solve(I_minus_Q.T, start)      # start @ N
+        time_to_absorption = np.linalg.solve(I_minus_Q, ones)     # N @ 1
+
+    transient_names = [states[i] for i in transient]
+    absorbing_names = [states[i] for i in absorbing_idx]
+    # Initial mass already in absorbing states is absorbed there with certainty
+    initial_absorbed = np.asarray(initial_vector, dtype=float)[absorbing_idx] / (total or 1.0)
+    return {
+        "absorbing_states": absorbing_names,
+        "expected_time": pd.Series(expected_time, index=transient_names),
+        "life_expectancy": float(expected_time.sum()),
+        "absorption_probabilities": pd.Series(expected_time @ R + initial_absorbed, index=absorbing_names),
+        "time_to_absorption": pd.Series(time_to_absorption, index=transient_names),
+    }
+
+def run_absorbing_analysis(transitions, initial_population, backend="auto"):
+    """Compiles (or reuses) the model and runs absorbing_analysis from initial_population."""
+    model = compile_model(transitions, initial_population.keys(), backend)
+    if model.time_varying:
+        raise ValueError("The analytic solver needs constant transition probabilities.")
+    return absorbing_analysis(model.matrix, model.states, model.population_vector(initial_population))
@@ -0,0 +1,54 @@
+# simulation/allocation.py
+import numpy as np
+
+def _group_sum(index, weights, n_groups):
+    """Sums weights (..., n_entries) into n_groups bins along the last axis."""
+    if weights.ndim == 1:
+        return np.bincount(index, weights=weights, minlength=n_groups)
+    batch = weights.shape[0]
+    offsets = (np.arange(batch) * n_groups)[:, None]
+    return np.bincount((offsets + index).ravel(), weights=weights.ravel(), minlength=batch * n_groups).reshape(batch, n_groups)
+
+class IntegerAllocator:
+    """
+    Moves whole people with a vectorized largest-remainder method.
+    Each source's count is split over its row: everyone gets the floor of their expected
+    flow, and the people left over go one each to the entries with the largest remainders.
+    Population is conserved exactly, for all sources (and batch rows) at once.
+    matrix: a dense (n, n) array, a (batch, n, n) stack with one matrix per cohort, or a CSRMatrix.
+    The allocator keeps a view of the matrix values, so in-place patches to the matrix
+    (time-varying schedules) are picked up on the next step.
+    """
+    __slots__ = ("rows", "cols", "values", "row_start", "n_states")
+
+    def __init__(self, matrix):
+        n_states = matrix.shape[-1]
+        if isinstance(matrix, np.ndarray):
+            self.rows = np.repeat(np.arange(n_states), n_states)
+            self.cols = np.tile(np.arange(n_states), n_states)
+            self.values = matrix.reshape(matrix.shape[:-2] + (-1,))
+            self.row_start = np.arange(n_states) * n_states
+        else:
+            self.rows, self.cols, self.values = matrix.coo()
+            self.row_start = matrix.indptr[:-1]
+        self.n_states = n_states
+
+    def flows(self, counts):
+        """Integer flow along every stored entry, shape (..., n_entries), for counts (..., n_states)."""
+        counts = np.asarray(counts, dtype=float)
+        expected = counts[..., self.rows] * self.values
+        floors = np.floor(expected)
+        remainders = expected - floors
+        shortfall = counts - _group_sum(self.rows, floors, self.n_states)
+
+        # rows - remainder keeps rows apart (remainders lie in [0, 1)) and orders each
+        # row's entries by descending remainder, so one argsort ranks every row at once
+        order = np.argsort(self.rows - remainders, axis=-1, kind="stable")
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.broadcast_to(np.arange(order.shape[-1]), order.shape), axis=-1)
+        rank -= self.row_start[self.rows]
+        return floors + (rank < shortfall[..., self.rows])
+
+    def step(self, counts):
+        """Returns the next (..., n_states) counts; their total always equals counts' total."""
+        return _group_sum(self.cols, self.flows(counts), self.n_states)
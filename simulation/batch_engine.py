@@ -0,0 +1,109 @@
+# simulation/batch_engine.py
+import numpy as np
+import pandas as pd
+
+from simulation.allocation import IntegerAllocator
+from simulation.precision import compute_dtype, trace_dtype
+from simulation.transition_matrix import (
+    build_state_index,
+    build_transition_matrix,
+    build_transition_operator,
+    population_vector,
+)
+
+def advance_batch(matrices, initial_vectors, num_steps, round_counts=False, out=None, integer=False, dtype=None):
+    """
+    Advances a batch of cohorts together, one broadcasted matmul per step.
+    matrices: one (n_states, n_states) operator (dense or CSRMatrix) shared by every cohort,
+        or a (batch, n_states, n_states) stack with one matrix per cohort.
+    initial_vectors: (n_states,) or (batch, n_states) starting populations.
+    out: Optional preallocated (batch, num_steps + 1, n_states) array to write into,
+        e.g. a view over shared memory. Its dtype overrides dtype.
+    integer: Move whole people with IntegerAllocator, conserving each cohort's total exactly.
+    dtype: Trace dtype, float64 (default), float32, int32 or int64. float32 halves memory and is
+        also computed in float32; integer traces are rounded to whole people every step.
+    Returns a (batch, num_steps + 1, n_states) trace.
+    """
+    dtype = trace_dtype(dtype if out is None else out.dtype)
+    initial_vectors = np.asarray(initial_vectors, dtype=float)
+    stacked = isinstance(matrices, np.ndarray) and matrices.ndim == 3
+    if isinstance(matrices, np.ndarray) and not integer:
+        matrices = matrices.astype(compute_dtype(dtype), copy=False)
+    n_states = matrices.shape[-1]
+    batch = max(matrices.shape[0] if stacked else 1, initial_vectors.shape[0] if initial_vectors.ndim == 2 else 1)
+
+    trace = np.empty((batch, num_steps + 1, n_states), dtype=dtype) if out is None else out
+    trace[:, 0] = np.rint(initial_vectors) if integer or dtype.kind == "i" else initial_vectors
+    if integer:
+        allocator = IntegerAllocator(matrices)
+        for step in range(1, num_steps + 1):
+            trace[:, step] = allocator.step(trace[:, step - 1])
+        return trace
+    if dtype.kind == "i":
+        # Integer traces only hold whole people, so each step is computed in float and rounded
+        for step in range(1, num_steps + 1):
+            previous = trace[:, step - 1, None, :] if stacked else trace[:, step - 1]
+            trace[:, step] = np.rint(previous @ matrices).reshape(batch, n_states)
+        return trace
+    for step in range(1, num_steps + 1):
+        if stacked:
+            # (batch, 1, n) @ (batch, n, n) -> (batch, 1, n)
+            np.matmul(trace[:, step - 1, None, :], matrices, out=trace[:, step, None, :])
+        elif isinstance(matrices, np.ndarray):
+            np.matmul(trace[:, step - 1], matrices, out=trace[:, step])
+        else:
+            trace[:, step] = trace[:, step - 1] @ matrices
+        if round_counts:
+            np.rint(trace[:, step], out=trace[:, step])
+    return trace
+
+def batch_to_frame(trace, states, scenario_labels=None, batch_column='Scenario'):
+    """
+    Flattens a (batch, steps, n_states) trace into a tidy long-format DataFrame
+    with batch_column (Scenario by default), Step, State and Population columns.
+    """
+    batch, steps, n_states = trace.shape
+    if scenario_labels is None:
+        scenario_labels = range(batch)
+    return pd.DataFrame({
+        batch_column: np.repeat(np.asarray(list(scenario_labels)), steps * n_states),
+        'Step': np.tile(np.repeat(np.arange(steps), n_states), batch),
+        'State': np.tile(np.asarray(states, dtype=object), batch * steps),
+        'Population': trace.reshape(-1),
+    })
+
+def run_batch_simulation(transitions, initial_populations, num_steps, scenario_labels=None,
+                         output="frame", round_counts=True, backend="auto", integer=False, dtype=None):
+    """
+    Runs many scenarios in one tensor pass instead of one run_discrete_simulation call each.
+    transitions: One transitions list shared by every scenario, or a list of transitions lists
+        (one per scenario). All scenarios are placed on the union of their states.
+    initial_populations: One {state: count} dict, or a list of dicts (one per scenario).
+    output: "frame" for a tidy long-format DataFrame, or "array" for (trace, states) where
+        trace has shape (batch, num_steps + 1, n_states).
+    integer: Allocate whole people by largest remainder instead of rounding (see advance_batch).
+    dtype: Trace dtype (see advance_batch); float32 or int32 halve the memory of large batches.
+    """
+    per_scenario = bool(transitions) and not isinstance(transitions[0], dict)
+    transition_sets = transitions if per_scenario else [transitions]
+    populations = [initial_populations] if isinstance(initial_populations, dict) else list(initial_populations)
+    batch_sizes = {len(transition_sets) if per_scenario else 1, len(populations)} - {1}
+    if len(batch_sizes) > 1:
+        raise ValueError("Transition and population batches must have the same length.")
+
+    all_transitions = [t for transition_set in transition_sets for t in transition_set]
+    merged_population = {state: 0 for population in populations for state in population}
+    states, state_index = build_state_index(all_transitions, merged_population)
+
+    if per_scenario:
+        matrices = np.stack([build_transition_matrix(t, state_index) for t in transition_sets])
+    else:
+        matrices = build_transition_operator(transitions, state_index, backend)
+    initial_vectors = np.stack([population_vector(p, state_index) for p in populations])
+
+    trace = advance_batch(matrices, initial_vectors, num_steps, round_counts=round_counts, integer=integer, dtype=dtype)
+    if output == "array":
+        return trace, states
+    if output == "frame":
+        return batch_to_frame(trace, states, scenario_labels)
+    raise ValueError(f"Unknown output '{output}'.")
@@ -0,0 +1,197 @@
+# simulation/compiled_model.py
+import hashlib
+import json
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+
+from simulation.time_varying import compile_time_varying, has_time_varying, is_time_varying
+from simulation.sparse_matrix import CSRMatrix
+from simulation.transition_matrix import (
+    build_state_index,
+    build_transition_operator,
+    population_vector,
+)
+
+MODEL_CACHE_SIZE = 64
+
+_model_cache = LRUCache(maxsize=MODEL_CACHE_SIZE)
+_model_cache_lock = threading.Lock()
+
+def validate_transitions(transitions):
+    """Returns a list of human-readable problems with the transitions (empty when valid)."""
+    problems = []
+    totals = {}
+    for i, t in enumerate(transitions):
+        source, target, p = t.get("source"), t.get("target"), t.get("probability")
+        if not source or not target:
+            problems.append(f"Transition {i + 1} is missing a source or target and is ignored.")
+            continue
+        if isinstance(p, (int, float)):
+            if p < 0 or p > 1:
+                problems.append(f"Probability {source} -> {target} is {p}, outside [0, 1].")
+            totals[source] = totals.get(source, 0.0) + p
+    for source, total in totals.items():
+        if abs(total - 1.0) > 1e-6:
+            problems.append(f"Outgoing from '{source}' sum to {total:.2f}, not 1.0.")
+    return problems
+
+def _canonical(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (tuple, set)):
+        return list(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot hash {type(value).__name__} model content.")
+
+def model_hash(transitions, extra_states=(), backend="auto"):
+    """
+    Canonical content hash of everything compilation depends on.
+    Returns None for content with no stable serialisation (e.g. probability functions).
+    """
+    content = {"transitions": transitions, "states": sorted(extra_states), "backend": backend}
+    try:
+        encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), default=_canonical)
+    except TypeError:
+        return None
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+class CompiledModel:
+    """
+    A transitions list compiled once into its state index map, transition operator and
+    validation results. Build through compile_model / compile_config to share the cache.
+    """
+    __slots__ = ("model_hash", "states", "state_index", "transitions", "source_transitions", "extra_states",
+                 "backend", "matrix", "time_varying", "problems", "_absorbing")
+
+    def __init__(self, transitions, extra_states=(), backend="auto", content_hash=None):
+        self.problems = validate_transitions(transitions)
+        # Half-filled rows from the Draw tab are reported above and left out of the model
+        self.transitions = [dict(t) for t in transitions if t.get("source") and t.get("target")]
+        # The list as given, which is what model_hash covers (e.g. to recompile a checkpoint)
+        self.source_transitions = [dict(t) for t in transitions]
+        self.extra_states = list(extra_states)
+        self.states, self.state_index = build_state_index(self.transitions, dict.fromkeys(extra_states, 0))
+        self.backend = backend
+        self.time_varying = has_time_varying(self.transitions)
+        # Time-varying operators depend on the horizon, so they are built per run by operator()
+        self.matrix = None if self.time_varying else build_transition_operator(self.transitions, self.state_index, backend)
+        self.model_hash = content_hash
+        self._absorbing = _absorbing_mask(self.transitions, self.state_index)
+
+    @property
+    def n_states(self):
+        return len(self.states)
+
+    @property
+    def is_valid(self):
+        return not self.problems
+
+    def population_vector(self, initial_population):
+        return population_vector(initial_population, self.state_index)
+
+    def absorbing_states(self):
+        """Read-only boolean mask of states with no outgoing transition to another state (at any cycle)."""
+        return self._absorbing
+
+    def operator(self, num_steps):
+        """Returns (matrix, schedule) for a run of num_steps; schedule is None for constant models."""
+        if not self.time_varying:
+            return self.matrix, None
+        matrix, positions, values = compile_time_varying(self.transitions, self.state_index, num_steps, self.backend)
+        return matrix, (positions, values)
+
+def _absorbing_mask(transitions, state_index):
+    absorbing = np.ones(len(state_index), dtype=bool)
+    for t in transitions:
+        p = t["probability"]
+        if t["source"] != t["target"] and (is_time_varying(p) or p):
+            absorbing[state_index[t["source"]]] = False
+    absorbing.flags.writeable = False
+    return absorbing
+
+def _complete(transition):
+    return bool(transition.get("source") and transition.get("target"))
+
+def patch_model(model, transitions, index):
+    """
+    Returns the CompiledModel for `transitions`, which must equal the model's source transitions
+    except for the probability of transitions[index]. Instead of recompiling, the model's
+    operator is copied and only the changed edge and its source's retained mass are patched.
+    The result is registered in the compile cache, so compile_model on the same content hits it.
+    Falls back to a full compile when a patch is not possible (time-varying or unstored entries).
+    """
+    key = model_hash(transitions, model.extra_states, model.backend)
+    if key is not None:
+        with _model_cache_lock:
+            cached = _model_cache.get(key)
+        if cached is not None:
+            return cached
+
+    changed = transitions[index]
+    position = sum(_complete(t) for t in transitions[:index])
+    patchable = (key is not None and _complete(changed) and not model.time_varying
+                 and not is_time_varying(changed["probability"])
+                 and position < len(model.transitions)
+                 and model.transitions[position]["source"] == changed["source"]
+                 and model.transitions[position]["target"] == changed["target"])
+    if not patchable:
+        return compile_model(transitions, model.extra_states, model.backend)
+
+    source = model.state_index[changed["source"]]
+    target = model.state_index[changed["target"]]
+    delta = changed["probability"] - model.transitions[position]["probability"]
+    if isinstance(model.matrix, np.ndarray):
+        matrix = model.matrix.copy()
+        matrix[source, target] += delta
+        matrix[source, source] -= delta
+    else:
+        positions = model.matrix.entry_positions([source, source], [target, source])
+        if (positions < 0).any():
+            return compile_model(transitions, model.extra_states, model.backend)
+        matrix = CSRMatrix(model.matrix.indptr, model.matrix.indices, model.matrix.data.copy(), model.matrix.shape)
+        matrix.data[positions[0]] += delta
+        matrix.data[positions[1]] -= delta
+
+    patched = CompiledModel.__new__(CompiledModel)
+    for slot in CompiledModel.__slots__:
+        setattr(patched, slot, getattr(model, slot))
+    patched.transitions = list(model.transitions)
+    patched.transitions[position] = dict(changed)
+    patched.source_transitions = [dict(t) for t in transitions]
+    patched.matrix = matrix
+    patched._absorbing = _absorbing_mask(patched.transitions, patched.state_index)
+    patched.problems = validate_transitions(transitions)
+    patched.model_hash = key
+    with _model_cache_lock:
+        _model_cache[key] = patched
+    return patched
+
+def compile_model(transitions, extra_states=(), backend="auto"):
+    """
+    Returns the CompiledModel for these transitions, reusing a cached one when the content
+    hash matches. extra_states are states that must exist even without transitions
+    (e.g. the initial state).
+    """
+    extra_states = list(dict.fromkeys(extra_states))
+    key = model_hash(transitions, extra_states, backend)
+    if key is None:
+        return CompiledModel(transitions, extra_states, backend)
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+    if model is None:
+        model = CompiledModel(transitions, extra_states, backend, content_hash=key)
+        with _model_cache_lock:
+            _model_cache[key] = model
+    return model
+
+def compile_config(config, backend="auto"):
+    """Compiles a saved/drawn config dict (transitions plus initial_state)."""
+    extra_states = [config['initial_state']] if config.get('initial_state') else []
+    return compile_model(config.get('transitions', []), extra_states, backend)
+
+def clear_model_cache():
+    with _model_cache_lock:
+        _model_cache.clear()
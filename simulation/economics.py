@@ -0,0 +1,101 @@
+# simulation/economics.py
+import numpy as np
+import pandas as pd
+
+# Length of one cycle in years for each timestep unit offered in the app
+CYCLE_LENGTH_YEARS = {
+    "Year": 1.0,
+    "Month": 1.0 / 12.0,
+    "Week": 7.0 / 365.25,
+    "Day": 1.0 / 365.25,
+}
+
+OUTCOME_COLUMNS = ['Cost', 'Life Years', 'QALYs']
+
+def discount_factors(num_cycles, annual_rate, timestep_unit="Year"):
+    """Returns the (num_cycles,) discount factor of each cycle, 1 / (1 + r) ** t with t in years."""
+    years = np.arange(num_cycles) * CYCLE_LENGTH_YEARS[timestep_unit]
+    return (1.0 + annual_rate) ** -years
+
+def payoff_matrix(states, state_costs=None, state_utilities=None, dead_states=("Dead",), timestep_unit="Year"):
+    """
+    Builds the (n_states, 3) per-cycle payoff matrix with Cost, Life Years and QALYs columns.
+    state_costs: {state: cost per cycle}.
+    state_utilities: {state: annual utility}, scaled to the cycle length.
+    dead_states: States that accrue no life-years.
+    """
+    cycle_years = CYCLE_LENGTH_YEARS[timestep_unit]
+    state_costs = state_costs or {}
+    state_utilities = state_utilities or {}
+    dead_states = set(dead_states or ())
+    payoffs = np.zeros((len(states), len(OUTCOME_COLUMNS)))
+    for i, state in enumerate(states):
+        payoffs[i, 0] = state_costs.get(state, 0.0)
+        payoffs[i, 1] = 0.0 if state in dead_states else cycle_years
+        payoffs[i, 2] = state_utilities.get(state, 0.0) * cycle_years
+    return payoffs
+
+def transition_cost_matrix(transitions, state_index):
+    """Returns the (n_states, n_states) one-off cost of each move, from each transition's optional 'cost'."""
+    n_states = len(state_index)
+    costs = np.zeros((n_states, n_states))
+    for t in transitions:
+        if t.get("cost"):
+            costs[state_index[t["source"]], state_index[t["target"]]] = t["cost"]
+    return costs
+
+def add_transition_costs(payoffs, matrices, costs):
+    """
+    Folds one-off transition costs into the Cost column as the expected cost each source pays
+    per cycle, sum over targets of probability x cost.
+    matrices may be one (n, n) matrix or a (batch, n, n) stack, giving (batch, n, 3) payoffs.
+    """
+    if not isinstance(matrices, np.ndarray):
+        matrices = matrices.toarray()
+    expected = (matrices * costs).sum(axis=-1)
+    payoffs = np.broadcast_to(payoffs, expected.shape + (payoffs.shape[-1],)).copy()
+    payoffs[..., 0] += expected
+    return payoffs
+
+def evaluate_payoffs(trace, payoffs, cost_discount, outcome_discount):
+    """
+    Totals discounted outcomes with one trace x payoff matrix product.
+    Each cycle's payoffs accrue to the cohort at the start of the cycle, so trace rows
+    0..T-1 are used for T discount factors.
+    trace: (..., T + 1, n_states); payoffs: (n_states, 3) or (..., n_states, 3).
+    Returns (..., 3) totals in OUTCOME_COLUMNS order.
+    """
+    num_cycles = cost_discount.shape[0]
+    discounts = np.column_stack([cost_discount, outcome_discount, outcome_discount])
+    per_cycle = trace[..., :num_cycles, :] @ payoffs
+    return (per_cycle * discounts).sum(axis=-2)
+
+def economic_outcomes(config, trace, states, matrices=None):
+    """
+    Computes discounted Cost, Life Years and QALYs for a single, batched or PSA trace.
+    config keys used: state_costs, state_utilities, dead_states (default ["Dead"]),
+        timestep_unit, discount_rate (annual, default 0), and the optional
+        discount_rate_costs / discount_rate_outcomes overrides. Transitions may carry a 'cost'.
+    matrices: Transition matrix (or per-iteration stack) used for the trace; needed only when
+        transitions carry one-off costs.
+    Returns a DataFrame with one row per trace in the batch (one row for a single run).
+    """
+    unit = config.get('timestep_unit', "Year")
+    rate = config.get('discount_rate', 0.0)
+    payoffs = payoff_matrix(states,
+                            config.get('state_costs'),
+                            config.get('state_utilities'),
+                            config.get('dead_states', ["Dead"]),
+                            unit)
+    state_index = {state: i for i, state in enumerate(states)}
+    transitions = config.get('transitions', [])
+    if any(t.get("cost") for t in transitions):
+        if matrices is None:
+            raise ValueError("Transition costs need the transition matrices used for the trace.")
+        payoffs = add_transition_costs(payoffs, matrices, transition_cost_matrix(transitions, state_index))
+
+    num_cycles = trace.shape[-2] - 1
+    totals = evaluate_payoffs(trace, payoffs,
+                              discount_factors(num_cycles, config.get('discount_rate_costs', rate), unit),
+                              discount_factors(num_cycles, config.get('discount_rate_outcomes', rate), unit))
+    return pd.DataFrame(totals.reshape(-1, len(OUTCOME_COLUMNS)), columns=OUTCOME_COLUMNS)
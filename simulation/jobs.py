@@ -0,0 +1,137 @@
+# simulation/jobs.py
+import threading
+import uuid
+
+import numpy as np
+
+from simulation.precision import trace_dtype
+from simulation.result_cache import result_cache, result_key
+from simulation.resumable import SimulationRun
+from simulation.simulation_engine import iter_simulation_chunks
+
+JOB_CHECK_EVERY = 64
+MAX_JOBS = 64
+
+# Shared by every session of the process. Finished jobs stay here until collected; beyond
+# MAX_JOBS the oldest finished ones are dropped, running jobs never are
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class SimulationCancelled(Exception):
+    """Raised by run_cancellable when its cancel token is set."""
+
+def run_cancellable(model, initial_population, num_steps, mode="expected", seed=None, dtype=np.int64,
+                    check_every=JOB_CHECK_EVERY, cancel=None, progress=None):
+    """
+    simulate_model computed in chunks of check_every steps so it can be stopped: between chunks
+    the cancel token (a threading.Event) is checked and progress(steps_done) is called.
+    Raises SimulationCancelled when cancelled.
+    Expected and integer runs go through the shared result cache like simulate_model: the cached
+    SimulationRun is extended chunk by chunk, so a repeated or longer run only computes new steps,
+    and the steps finished before a cancel are kept for the next run.
+    Returns (steps, trace) like simulate_model.
+    """
+    dtype = trace_dtype(dtype)
+    key = result_key(model, None, initial_population, mode, dtype=dtype.name) if mode in ("expected", "integer") else None
+    if key is not None:
+        run = result_cache.get(key) or SimulationRun(model, initial_population, mode == "integer", dtype)
+        try:
+            while run.num_steps < num_steps:
+                run.extend(min(num_steps, run.num_steps + check_every), horizon=num_steps)
+                if progress is not None:
+                    progress(run.num_steps)
+                if cancel is not None and cancel.is_set():
+                    raise SimulationCancelled()
+        finally:
+            result_cache.put(key, run)  # re-put so the byte budget sees the longer history
+        return np.arange(num_steps + 1), run.trace[:num_steps + 1]
+
+    trace = np.empty((num_steps + 1, model.n_states), dtype=dtype)
+    for first_step, block in iter_simulation_chunks(model, initial_population, num_steps, check_every, mode, seed, dtype):
+        trace[first_step:first_step + len(block)] = block
+        if progress is not None:
+            progress(first_step + len(block) - 1)
+        if cancel is not None and cancel.is_set():
+            raise SimulationCancelled()
+    trace.flags.writeable = False
+    return np.arange(num_steps + 1), trace
+
+class SimulationJob:
+    """
+    A run_cancellable call on a background thread, so a long run does not hold the caller.
+    status is "pending", "running", "done", "cancelled" or "failed"; result holds
+    (steps, trace) once done. meta is free-form data for whoever collects the job.
+    """
+    def __init__(self, model, initial_population, num_steps, mode="expected", seed=None, dtype=np.int64,
+                 check_every=JOB_CHECK_EVERY, meta=None):
+        self.job_id = uuid.uuid4().hex
+        self.model = model
+        self.num_steps = num_steps
+        self.meta = dict(meta or {})
+        self.steps_done = 0
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(initial_population, mode, seed, dtype, check_every),
+            name=f"simulation-{self.job_id[:8]}",
+            daemon=True,
+        )
+
+    @property
+    def progress(self):
+        return self.steps_done / self.num_steps if self.num_steps else 1.0
+
+    @property
+    def running(self):
+        return self.status in ("pending", "running")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Asks the job to stop; it does so at its next check, within check_every steps."""
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the job finishes or timeout passes; returns True once it has finished."""
+        self._thread.join(timeout)
+        return not self.running
+
+    def _set_progress(self, steps_done):
+        self.steps_done = steps_done
+
+    def _run(self, initial_population, mode, seed, dtype, check_every):
+        self.status = "running"
+        try:
+            self.result = run_cancellable(self.model, initial_population, self.num_steps, mode, seed, dtype,
+                                          check_every, self._cancel, self._set_progress)
+        except SimulationCancelled:
+            self.status = "cancelled"
+        except Exception as exc:
+            self.error = exc
+            self.status = "failed"
+        else:
+            self.status = "done"
+
+def submit_job(model, initial_population, num_steps, **options):
+    """Starts a SimulationJob (options as for SimulationJob) and registers it under its job_id."""
+    job = SimulationJob(model, initial_population, num_steps, **options)
+    with _jobs_lock:
+        finished = [job_id for job_id, other in _jobs.items() if not other.running]
+        for job_id in finished[:max(0, len(_jobs) + 1 - MAX_JOBS)]:
+            del _jobs[job_id]  # dicts keep insertion order, so these are the oldest
+        _jobs[job.job_id] = job
+    return job.start()
+
+def get_job(job_id):
+    """Returns the registered job, or None if it is unknown or was dropped after finishing."""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def forget_job(job_id):
+    with _jobs_lock:
+        _jobs.pop(job_id, None)
@@ -0,0 +1,107 @@
+# simulation/parallel_psa.py
+import math
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from simulation.batch_engine import advance_batch
+from simulation.precision import trace_dtype
+from simulation.psa import sample_transition_matrices
+from simulation.transition_matrix import build_state_index, population_vector
+
+# Environment variables read by the common BLAS/OpenMP runtimes when NumPy is imported
+BLAS_THREAD_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+@contextmanager
+def blas_thread_limit(num_threads):
+    """
+    Temporarily sets the BLAS thread variables so that freshly spawned workers start
+    with num_threads BLAS threads each. None leaves the environment untouched.
+    """
+    if num_threads is None:
+        yield
+        return
+    saved = {var: os.environ.get(var) for var in BLAS_THREAD_VARS}
+    os.environ.update({var: str(num_threads) for var in BLAS_THREAD_VARS})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+def _release_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # still exported at interpreter exit; the mapping goes away with the process
+
+def _psa_chunk(shm_name, shape, dtype, start, stop, transitions, state_index, initial_vector, seed_seq):
+    """Worker: samples and simulates iterations [start, stop) straight into the shared trace buffer."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        trace = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        rng = np.random.default_rng(seed_seq)
+        matrices = sample_transition_matrices(transitions, state_index, stop - start, rng)
+        advance_batch(matrices, initial_vector, shape[1] - 1, out=trace[start:stop])
+        del trace
+    finally:
+        shm.close()
+    return stop - start
+
+def run_parallel_psa(transitions, initial_population, num_steps, n_iterations, workers=None,
+                     chunk_size=None, seed=None, blas_threads=1, dtype=None):
+    """
+    Runs the same PSA as run_psa, split into chunks across a process pool.
+    Workers write their traces directly into one shared-memory buffer, so only the
+    chunk bounds are sent back to the parent.
+    workers: Number of worker processes (defaults to os.cpu_count()).
+    chunk_size: Iterations per task (defaults to about four tasks per worker). Draws are
+        seeded per chunk, so results are reproducible for a fixed seed and chunk_size.
+    blas_threads: BLAS threads per worker, to avoid oversubscribing the machine (None to inherit).
+    The returned trace is the shared buffer itself, not a copy, so peak memory stays at one
+    trace; the shared memory is released once the trace (and every view of it) is collected.
+    dtype: Trace dtype (see run_psa); also sets the size of the shared buffer.
+    Returns (trace, states) where trace has shape (n_iterations, num_steps + 1, n_states).
+    """
+    dtype = trace_dtype(dtype)
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or max(1, math.ceil(n_iterations / (workers * 4)))
+    states, state_index = build_state_index(transitions, initial_population)
+    initial_vector = population_vector(initial_population, state_index)
+
+    shape = (n_iterations, num_steps + 1, len(states))
+    bounds = [(start, min(start + chunk_size, n_iterations)) for start in range(0, n_iterations, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, math.prod(shape) * dtype.itemsize))
+    try:
+        # Spawned workers import NumPy fresh, so they pick up the BLAS thread limit
+        with blas_thread_limit(blas_threads), ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            futures = [
+                pool.submit(_psa_chunk, shm.name, shape, dtype, start, stop, transitions, state_index, initial_vector, seq)
+                for (start, stop), seq in zip(bounds, seeds)
+            ]
+            for future in futures:
+                future.result()
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    # Drop the name now; the mapping itself lives as long as the returned array
+    shm.unlink()
+    trace = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    weakref.finalize(trace, _release_shared_memory, shm)
+    return trace, states
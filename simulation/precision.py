@@ -0,0 +1,47 @@
+# simulation/precision.py
+import numpy as np
+
+TRACE_DTYPES = (np.dtype(np.float64), np.dtype(np.float32), np.dtype(np.int64), np.dtype(np.int32))
+
+def trace_dtype(dtype):
+    """
+    Resolves a trace dtype option: a name such as "float32" or "int", or a NumPy dtype.
+    None means float64. Raises ValueError for anything but float32/float64/int32/int64.
+    """
+    resolved = np.dtype(np.float64 if dtype is None else dtype)
+    if resolved not in TRACE_DTYPES:
+        raise ValueError(f"Unsupported trace dtype '{dtype}'; use float32, float64, int32 or int64.")
+    return resolved
+
+def compute_dtype(dtype):
+    """Dtype to do the arithmetic in: float32 traces are computed in float32, everything else in float64."""
+    dtype = trace_dtype(dtype)
+    return dtype if dtype == np.float32 else np.dtype(np.float64)
+
+def dtype_drift(run, dtype=np.float32, trace=None):
+    """
+    Accuracy check for a reduced-precision trace.
+    run: callable taking a dtype and returning a trace, e.g.
+        lambda dtype: run_psa(transitions, population, 100, 1000, seed=1, dtype=dtype)[0].
+        It is called once with float64 and once with dtype, so it must be deterministic.
+    trace: callable picking the trace out of run's result when run returns more than the trace,
+        e.g. lambda result: result[1] for simulate_model's (steps, trace).
+    Returns a dict with the maximum absolute and relative drift of the dtype trace versus
+    float64 and the memory both traces take.
+    """
+    reference = run(np.float64)
+    reduced = run(dtype)
+    if trace is not None:
+        reference, reduced = trace(reference), trace(reduced)
+    if not isinstance(reference, np.ndarray) or not isinstance(reduced, np.ndarray):
+        raise ValueError("run must return the trace array; pass trace= to select it from a tuple result.")
+    drift = np.abs(reduced.astype(np.float64) - reference)
+    max_drift = float(drift.max()) if drift.size else 0.0
+    scale = float(np.abs(reference).max()) if reference.size else 0.0
+    return {
+        "dtype": str(trace_dtype(dtype)),
+        "max_abs_drift": max_drift,
+        "max_rel_drift": max_drift / scale if scale else 0.0,
+        "nbytes": int(reduced.nbytes),
+        "float64_nbytes": int(reference.nbytes),
+    }
@@ -0,0 +1,135 @@
+# simulation/psa.py
+import numpy as np
+import pandas as pd
+
+from simulation.batch_engine import advance_batch
+from simulation.transition_matrix import (
+    build_state_index,
+    edge_matrices,
+    population_vector,
+    transition_arrays,
+)
+
+def _distribution_arrays(transitions):
+    """
+    Splits the transitions into Beta-distributed edges and Dirichlet groups.
+    residual_edges are the fixed self-loops of sources with a Beta edge: they hold the retained
+    mass, so they absorb the draws instead of keeping their fixed value.
+    Returns (beta_edges, beta_alpha, beta_beta, residual_edges, dirichlet_edges, dirichlet_alpha,
+    dirichlet_group).
+    """
+    beta_edges, beta_alpha, beta_beta = [], [], []
+    dirichlet_edges, dirichlet_alpha, dirichlet_sources = [], [], []
+    fixed_sources = set()
+    for i, t in enumerate(transitions):
+        spec = t.get("distribution")
+        if not spec:
+            fixed_sources.add(t["source"])
+            continue
+        kind = str(spec.get("type", "")).lower()
+        if kind == "beta":
+            beta_edges.append(i)
+            beta_alpha.append(spec["alpha"])
+            beta_beta.append(spec["beta"])
+            fixed_sources.add(t["source"])
+        elif kind == "dirichlet":
+            dirichlet_edges.append(i)
+            dirichlet_alpha.append(spec["alpha"])
+            dirichlet_sources.append(t["source"])
+        else:
+            raise ValueError(f"Unknown distribution type '{spec.get('type')}' on {t['source']} -> {t['target']}.")
+
+    mixed = fixed_sources.intersection(dirichlet_sources)
+    if mixed:
+        raise ValueError(f"Dirichlet sources must draw every outgoing edge from the Dirichlet: {sorted(mixed)}.")
+
+    beta_sources = {transitions[i]["source"] for i in beta_edges}
+    residual_edges = [i for i, t in enumerate(transitions)
+                      if t["source"] == t["target"] and t["source"] in beta_sources and not t.get("distribution")]
+
+    group_of = {source: g for g, source in enumerate(dict.fromkeys(dirichlet_sources))}
+    return (np.asarray(beta_edges, dtype=np.intp), np.asarray(beta_alpha, dtype=float), np.asarray(beta_beta, dtype=float),
+            np.asarray(residual_edges, dtype=np.intp),
+            np.asarray(dirichlet_edges, dtype=np.intp), np.asarray(dirichlet_alpha, dtype=float),
+            np.asarray([group_of[s] for s in dirichlet_sources], dtype=np.intp))
+
+def sample_transition_matrices(transitions, state_index, n_iterations, rng):
+    """
+    Draws n_iterations transition matrices in one vectorized pass.
+    A transition may carry an optional distribution spec next to its fixed probability:
+      {"type": "beta", "alpha": a, "beta": b}  for a single edge, drawn independently; the
+                                               source's retained mass (its explicit self-loop,
+                                               or the implicit diagonal) absorbs the difference.
+      {"type": "dirichlet", "alpha": a}        on every outgoing edge of a source; the
+                                               source's edges are drawn jointly and sum to 1.0.
+    Transitions without a spec keep their fixed probability in every iteration.
+    Raises ValueError if a draw leaves a source's transitions to other states above 1.0
+    (use a Dirichlet for sources with several uncertain edges).
+    rng: a numpy.random.Generator.
+    Returns an (n_iterations, n_states, n_states) array.
+    """
+    n_states = len(state_index)
+    sources, targets, probabilities = transition_arrays(transitions, state_index)
+    (beta_edges, beta_alpha, beta_beta, residual_edges,
+     dirichlet_edges, dirichlet_alpha, dirichlet_group) = _distribution_arrays(transitions)
+
+    edge_probabilities = np.broadcast_to(probabilities, (n_iterations, probabilities.size)).copy()
+    if beta_edges.size:
+        draws = rng.beta(beta_alpha, beta_beta, size=(n_iterations, beta_edges.size))
+        edge_probabilities[:, beta_edges] = draws
+        # edge_matrices puts 1 - row sum on the diagonal, so zeroed self-loops become the residual
+        edge_probabilities[:, residual_edges] = 0.0
+    if dirichlet_edges.size:
+        # Dirichlet draws are normalised Gamma draws; all groups are drawn at once and
+        # normalised with a one-hot edge -> group product
+        gammas = rng.standard_gamma(dirichlet_alpha, size=(n_iterations, dirichlet_edges.size))
+        one_hot = np.zeros((dirichlet_edges.size, dirichlet_group.max() + 1))
+        one_hot[np.arange(dirichlet_edges.size), dirichlet_group] = 1.0
+        group_totals = gammas @ one_hot
+        edge_probabilities[:, dirichlet_edges] = gammas / group_totals[:, dirichlet_group]
+
+    if beta_edges.size:
+        # Retained mass is 1 - row sum, so leaving rows above 1 would give negative populations
+        leaving = sources != targets
+        row_totals = np.zeros((n_iterations, n_states))
+        np.add.at(row_totals, (slice(None), sources[leaving]), edge_probabilities[:, leaving])
+        over = np.flatnonzero((row_totals > 1.0 + 1e-9).any(axis=0))
+        if over.size:
+            names = [state for state, index in state_index.items() if index in set(over.tolist())]
+            raise ValueError(f"Sampled outgoing probabilities exceed 1.0 for {names}; "
+                             "use a Dirichlet for sources with several uncertain transitions.")
+
+    return edge_matrices(sources, targets, edge_probabilities, n_states)
+
+def run_psa(transitions, initial_population, num_steps, n_iterations, seed=None, dtype=None):
+    """
+    Runs a probabilistic sensitivity analysis: draws every parameter set up front and
+    simulates all n_iterations chains in one batched pass (expected counts, no rounding).
+    seed: int, SeedSequence or Generator for reproducible draws.
+    dtype: Trace dtype, float64 by default; float32 halves memory (see precision.dtype_drift
+        to check its accuracy on a given model).
+    Returns (trace, states) where trace has shape (n_iterations, num_steps + 1, n_states).
+    """
+    rng = np.random.default_rng(seed)
+    states, state_index = build_state_index(transitions, initial_population)
+    matrices = sample_transition_matrices(transitions, state_index, n_iterations, rng)
+    initial_vector = population_vector(initial_population, state_index)
+    return advance_batch(matrices, initial_vector, num_steps, dtype=dtype), states
+
+def summarize_psa(trace, states, interval=0.95):
+    """
+    Summarises a PSA trace per step and state.
+    Returns a long-format DataFrame with Step, State, Mean, Lower and Upper columns,
+    where Lower/Upper bound the central `interval` of the iterations.
+    """
+    tail = (1.0 - interval) / 2.0
+    mean = trace.mean(axis=0)
+    lower, upper = np.quantile(trace, [tail, 1.0 - tail], axis=0)
+    steps, n_states = mean.shape
+    return pd.DataFrame({
+        'Step': np.repeat(np.arange(steps), n_states),
+        'State': np.tile(np.asarray(states, dtype=object), steps),
+        'Mean': mean.reshape(-1),
+        'Lower': lower.reshape(-1),
+        'Upper': upper.reshape(-1),
+    })
@@ -0,0 +1,95 @@
+# simulation/result_cache.py
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+
+RESULT_CACHE_ENTRIES = 128
+RESULT_CACHE_BYTES = 256 * 1024 * 1024
+RANDOM_MODES = ("stochastic", "microsimulation")
+
+def result_nbytes(value):
+    """Approximate memory held by a cached result (arrays, DataFrames, runs, or tuples of them)."""
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(result_nbytes(v) for v in value)
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(deep=True).sum())
+    return 64
+
+class ResultCache:
+    """
+    Bounded LRU cache of simulation results with entry- and byte-based eviction and
+    hit/miss counters. Cached arrays should be marked read-only by the caller.
+    """
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES, max_bytes=RESULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self._cache = LRUCache(maxsize=max_bytes, getsizeof=result_nbytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = result_nbytes(value)
+        with self._lock:
+            if size > self._cache.maxsize:
+                return  # larger than the whole budget; never cached
+            before = len(self._cache) + (0 if key in self._cache else 1)
+            self._cache[key] = value  # LRUCache evicts by bytes here
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem()
+            self.evictions += max(0, before - len(self._cache))
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached result for key, or computes, stores and returns it. key None skips the cache."""
+        if key is None:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._cache),
+                "bytes": int(self._cache.currsize),
+            }
+
+def result_key(model, num_steps, initial_population, mode="expected", **options):
+    """
+    Key for a run of a compiled model, or None when the run must not be cached
+    (unhashable model, or a random mode without an integer seed).
+    num_steps may be None for entries that cover any horizon (resumable runs).
+    options: any further run settings, e.g. checkpoints or seed.
+    """
+    if model.model_hash is None:
+        return None
+    if mode in RANDOM_MODES and not isinstance(options.get("seed"), (int, np.integer)):
+        return None
+    population = tuple(sorted((state, float(count)) for state, count in initial_population.items() if count))
+    extra = tuple(sorted((name, tuple(value) if isinstance(value, (list, range)) else value)
+                         for name, value in options.items()))
+    return (model.model_hash, None if num_steps is None else int(num_steps), population, mode, extra)
+
+# Shared by the engine API and the app
+result_cache = ResultCache()
@@ -0,0 +1,128 @@
+# simulation/resumable.py
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from simulation.absorbing import advance_until_absorbed
+from simulation.compiled_model import compile_model
+from simulation.precision import trace_dtype
+
+class SimulationRun:
+    """
+    An expected- or integer-mode run that keeps its compiled model and full history, so asking
+    for a longer horizon only computes the new steps from the last state vector.
+    Rounding happens per step, so an extended run is identical to a fresh run of the same length.
+    integer: allocate whole people with IntegerAllocator instead of rounding each state.
+    dtype: dtype of the stored history (int64 by default; see precision.trace_dtype).
+    """
+    __slots__ = ("model", "initial_population", "integer", "num_steps", "_buffer", "_lock", "_operator", "_operator_steps")
+
+    def __init__(self, model, initial_population, integer=False, dtype=np.int64):
+        self.model = model
+        self.initial_population = dict(initial_population)
+        self.integer = integer
+        self.num_steps = 0
+        self._buffer = np.empty((1, model.n_states), dtype=trace_dtype(dtype))
+        self._buffer[0] = np.rint(model.population_vector(initial_population))
+        self._lock = threading.Lock()
+        # Time-varying operator and schedule compiled for _operator_steps cycles, reused by later extensions
+        self._operator = None
+        self._operator_steps = 0
+
+    @property
+    def trace(self):
+        """Read-only (num_steps + 1, n_states) view of the history."""
+        view = self._buffer[:self.num_steps + 1]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def final_state(self):
+        return self._buffer[self.num_steps].copy()
+
+    @property
+    def dtype(self):
+        return self._buffer.dtype
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    def extend(self, num_steps, checkpoint_every=None, checkpoint_path=None, horizon=None):
+        """
+        Advances the run to num_steps (no-op if it is already that long) and returns self.
+        checkpoint_every / checkpoint_path: save the run to disk every N new steps, so a very
+        long extension can be resumed with load_run if it is interrupted.
+        horizon: number of steps the caller will eventually extend to, so a time-varying schedule
+        is compiled once for all of them instead of once per extension.
+        """
+        horizon = max(num_steps, horizon or 0)
+        with self._lock:
+            while self.num_steps < num_steps:
+                target = num_steps if not checkpoint_every else min(num_steps, self.num_steps + checkpoint_every)
+                self._advance_to(target, horizon)
+                if checkpoint_path:
+                    self.save(checkpoint_path)
+        return self
+
+    def _advance_to(self, num_steps, horizon):
+        start = self.num_steps
+        if num_steps + 1 > self._buffer.shape[0]:
+            # Grow geometrically so repeated small extensions stay amortised O(1) per step
+            grown = np.empty((max(num_steps + 1, 2 * self._buffer.shape[0]), self.model.n_states), dtype=self._buffer.dtype)
+            grown[:start + 1] = self._buffer[:start + 1]
+            self._buffer = grown
+        if self._operator is None or self._operator_steps < num_steps:
+            self._operator = self.model.operator(horizon)
+            self._operator_steps = horizon
+        matrix, schedule = self._operator
+        if schedule is not None:
+            positions, values = schedule
+            schedule = (positions, values[start:num_steps])
+        # Once nobody is left outside the absorbing states the rest is filled in bulk
+        new_rows, _ = advance_until_absorbed(matrix, self._buffer[start], num_steps - start,
+                                             self.model.absorbing_states(), schedule=schedule,
+                                             integer=self.integer)
+        self._buffer[start + 1:num_steps + 1] = new_rows[1:]
+        self.num_steps = num_steps
+
+    def to_frame(self):
+        history = pd.DataFrame(self.trace, columns=self.model.states, copy=True)
+        history.insert(0, 'Step', range(self.num_steps + 1))
+        return history
+
+    def save(self, path):
+        """Writes the run (model definition plus history) to an .npz checkpoint."""
+        meta = {
+            "transitions": self.model.source_transitions,
+            "extra_states": self.model.extra_states,
+            "backend": self.model.backend,
+            "model_hash": self.model.model_hash,
+            "initial_population": self.initial_population,
+            "integer": self.integer,
+        }
+        try:
+            encoded = json.dumps(meta)
+        except TypeError:
+            raise ValueError("Runs whose probabilities are functions or arrays cannot be checkpointed; "
+                             "only JSON-serialisable models can be saved.")
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, trace=self._buffer[:self.num_steps + 1], meta=np.array(encoded))
+        # Replace atomically so an interrupted save never corrupts the last good checkpoint
+        os.replace(tmp_path, path)
+
+def load_run(path):
+    """Restores a SimulationRun saved with SimulationRun.save, ready to extend."""
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        trace = data["trace"]
+    model = compile_model(meta["transitions"], meta["extra_states"], meta["backend"])
+    if meta["model_hash"] is not None and model.model_hash != meta["model_hash"]:
+        raise ValueError("Checkpoint was written by a different model definition.")
+    run = SimulationRun(model, meta["initial_population"], meta.get("integer", False), trace.dtype)
+    run._buffer = trace
+    run.num_steps = trace.shape[0] - 1
+    return run
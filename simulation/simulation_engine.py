@@ -1,72 +1,183 @@
 # simulation/simulation_engine.py
+import numpy as np
 import pandas as pd
-import random # For more advanced Monte Carlo if probabilities are not exact numbers
 
-def run_discrete_simulation(transitions, initial_population, num_steps):
+from simulation.absorbing import absorbed_step, advance_until_absorbed
+from simulation.compiled_model import compile_model
+from simulation.microsimulation import simulate_patients
+from simulation.precision import trace_dtype
+from simulation.result_cache import result_cache, result_key
+from simulation.resumable import SimulationRun
+from simulation.stochastic_engine import advance_stochastic
+from simulation.transition_matrix import advance_cohort, checkpoint_distributions
+
+STREAM_CHUNK_STEPS = 64
+
+def simulate_model(model, initial_population, num_steps, checkpoints=None, mode="expected", seed=None,
+                   use_cache=True, dtype=np.int64):
+    """
+    Runs a compiled model and returns (steps, trace): the reported step numbers and a
+    (len(steps), n_states) trace of whole-people counts in model.states order, stored as dtype.
+    Results are memoized in the shared result cache by model hash, horizon, population, mode
+    and options; expected- and integer-mode runs are kept as resumable SimulationRuns, so
+    extending num_steps only computes the new steps.
+    The returned trace is read-only, so copy it before modifying.
+    See run_discrete_simulation for the meaning of the arguments.
+    """
+    if mode != "expected" and checkpoints is not None:
+        raise ValueError("Checkpoints are only available in expected mode.")
+    if model.time_varying and (mode not in ("expected", "integer") or checkpoints is not None):
+        raise ValueError("Time-varying probabilities are only supported in expected and integer modes without checkpoints.")
+    dtype = trace_dtype(dtype)
+    if checkpoints is not None:
+        checkpoints = sorted(set(int(c) for c in checkpoints))
+        if checkpoints and (checkpoints[0] < 0 or checkpoints[-1] > num_steps):
+            raise ValueError(f"Checkpoints must lie between 0 and {num_steps}.")
+
+    if use_cache and mode in ("expected", "integer") and checkpoints is None:
+        # Step-by-step deterministic runs are cached as resumable runs covering any horizon:
+        # a longer request extends the stored history instead of starting from step 0
+        key = result_key(model, None, initial_population, mode, dtype=dtype.name)
+        if key is not None:
+            run = result_cache.get(key) or SimulationRun(model, initial_population, mode == "integer", dtype)
+            if run.num_steps < num_steps:
+                run.extend(num_steps)
+                result_cache.put(key, run)  # re-put so the byte budget sees the longer history
+            return np.arange(num_steps + 1), run.trace[:num_steps + 1]
+
+    key = (result_key(model, num_steps, initial_population, mode, checkpoints=checkpoints, seed=seed, dtype=dtype.name)
+           if use_cache else None)
+    return result_cache.get_or_compute(key, lambda: _simulate(model, initial_population, num_steps, checkpoints, mode, seed,
+                                                              dtype))
+
+def _simulate(model, initial_population, num_steps, checkpoints, mode, seed, dtype):
+    initial_vector = model.population_vector(initial_population)
+    matrix, schedule = model.operator(num_steps)
+
+    if mode == "stochastic":
+        steps = range(num_steps + 1)
+        trace = advance_stochastic(matrix, initial_vector, num_steps, 1, np.random.default_rng(seed))[0]
+    elif mode == "microsimulation":
+        steps = range(num_steps + 1)
+        initial_states = np.repeat(np.arange(model.n_states, dtype=np.uint16), np.rint(initial_vector).astype(np.int64))
+        trace, _, _ = simulate_patients(matrix, initial_states, num_steps, np.random.default_rng(seed))
+    elif mode == "integer":
+        steps = range(num_steps + 1)
+        trace, _ = advance_until_absorbed(matrix, initial_vector, num_steps, model.absorbing_states(),
+                                          schedule=schedule, integer=True)
+    elif mode != "expected":
+        raise ValueError(f"Unknown simulation mode '{mode}'.")
+    elif checkpoints is not None:
+        steps = checkpoints
+        trace = np.rint(checkpoint_distributions(matrix, initial_vector, steps))
+    else:
+        steps = range(num_steps + 1)
+        # Populations are rounded to the nearest integer each step, starting with step 0,
+        # exactly as the cached SimulationRun does
+        trace, _ = advance_until_absorbed(matrix, np.rint(initial_vector), num_steps, model.absorbing_states(), schedule=schedule)
+
+    trace = trace.astype(dtype, copy=False)
+    trace.flags.writeable = False
+    return np.asarray(steps), trace
+
+def iter_simulation_chunks(model, initial_population, num_steps, chunk_steps=STREAM_CHUNK_STEPS, mode="expected",
+                           seed=None, dtype=np.int64):
+    """
+    Runs a compiled model chunk by chunk without keeping its history.
+    Yields (first_step, block) pairs, where block is a read-only (k, n_states) view holding
+    steps first_step .. first_step + k - 1; step 0 arrives in the first block. The chunk buffer
+    is reused, so copy a block to keep it past the next iteration.
+    With the same seed, the blocks concatenate to exactly the trace simulate_model returns.
+    Checkpoints are not supported; see run_discrete_simulation for the other arguments.
+    """
+    dtype = trace_dtype(dtype)
+    if model.time_varying and mode not in ("expected", "integer"):
+        raise ValueError("Time-varying probabilities are only supported in expected and integer modes.")
+    if mode not in ("expected", "integer", "stochastic", "microsimulation"):
+        raise ValueError(f"Unknown simulation mode '{mode}'.")
+    matrix, schedule = model.operator(num_steps)
+    absorbing = model.absorbing_states()
+    rng = np.random.default_rng(seed)
+
+    buffer = np.empty((chunk_steps + 1, model.n_states), dtype=dtype)
+    initial_vector = model.population_vector(initial_population)
+    buffer[0] = np.rint(initial_vector)
+    first = buffer[:1]
+    first.flags.writeable = False
+    yield 0, first
+
+    done = 0
+    patients = None  # one entry per person, so only built for microsimulation
+    absorbed = mode in ("expected", "integer") and absorbing.any() and absorbed_step(buffer[:1], absorbing, 0.5) is not None
+    while done < num_steps:
+        k = min(chunk_steps, num_steps - done)
+        if absorbed:
+            # Nobody is left to move, so the remaining steps repeat the last state
+            buffer[1:k + 1] = buffer[0]
+        elif mode == "stochastic":
+            buffer[:k + 1] = advance_stochastic(matrix, buffer[0], k, 1, rng)[0]
+        elif mode == "microsimulation":
+            if patients is None:
+                patients = np.repeat(np.arange(model.n_states, dtype=np.uint16), np.rint(initial_vector).astype(np.int64))
+            counts, patients, _ = simulate_patients(matrix, patients, k, rng)
+            buffer[:k + 1] = counts
+        else:
+            chunk_schedule = None if schedule is None else (schedule[0], schedule[1][done:done + k])
+            buffer[:k + 1] = advance_cohort(matrix, buffer[0], k, schedule=chunk_schedule, integer=mode == "integer")
+            absorbed = absorbing.any() and absorbed_step(buffer[1:k + 1], absorbing, 0.5) is not None
+        block = buffer[1:k + 1]
+        block.flags.writeable = False
+        yield done + 1, block
+        done += k
+        buffer[0] = buffer[k]
+
+def iter_simulation(model, initial_population, num_steps, mode="expected", seed=None, dtype=np.int64,
+                    chunk_steps=STREAM_CHUNK_STEPS):
+    """
+    Yields (step, state_vector) for steps 0..num_steps as they are computed, e.g. to drive a
+    progress bar, a file writer or a convergence check without holding the full history.
+    Vectors are read-only views into a reused buffer (see iter_simulation_chunks).
+    """
+    for first_step, block in iter_simulation_chunks(model, initial_population, num_steps, chunk_steps, mode, seed, dtype):
+        for offset, row in enumerate(block):
+            yield first_step + offset, row
+
+def run_discrete_simulation(transitions, initial_population, num_steps, backend="auto", checkpoints=None,
+                            mode="expected", seed=None, use_cache=True, truncate_when_absorbed=False, dtype=np.int64):
     """
     Runs a discrete-event simulation based on given transitions and initial population.
     transitions: List of dictionaries, e.g., [{"source": "Alive", "target": "Dead", "probability": 1.0}]
+        A probability may also be a per-cycle table (list) or a function of the cycle index.
     initial_population: Dict of initial counts for each state, e.g., {"Alive": 1000, "Dead": 0}
     num_steps: Number of simulation steps.
-    Returns a pandas DataFrame of populations at each step.
+    backend: "dense", "sparse", or "auto" to use the sparse matrix for large, low-density models.
+    checkpoints: Optional list of steps (0..num_steps) to report instead of every step. These are
+        reached by repeated squaring of the transition matrix and rounded once at the checkpoint,
+        so they can differ by a person or two from the step-by-step rounded run.
+    mode: "expected" applies expected flows rounded each step; "integer" splits each state's
+        people over its transitions by largest remainder, so whole people move and the total
+        population is conserved exactly; "stochastic" draws each step's
+        flows from a multinomial so whole people move (first-order uncertainty); "microsimulation"
+        tracks every person individually and reports the count in each state.
+    seed: Seed or numpy Generator for the stochastic and microsimulation modes.
+    use_cache: Reuse a memoized result for identical inputs (random modes only with an int seed).
+    truncate_when_absorbed: Drop the rows after everyone has reached an absorbing state.
+    dtype: dtype of the population columns (and of the cached trace): int64 by default,
+        or int32/float32 to halve memory, float64 for downstream numeric work.
+    Returns a pandas DataFrame of populations at each step (or at each checkpoint).
+    history.attrs["converged_step"] holds the first reported step with nobody left outside the
+    absorbing states (None if that never happens); expected runs stop computing there.
     """
-    # Collect all unique states
-    all_states = set(initial_population.keys())
-    for t in transitions:
-        all_states.add(t["source"])
-        all_states.add(t["target"])
-
-    # Initialize current populations, ensuring all states are represented
-    current_populations = {state: initial_population.get(state, 0) for state in all_states}
-
-    history_data = []
-    history_data.append([0] + [current_populations[s] for s in sorted(all_states)])
-
-    for step in range(1, num_steps + 1):
-        next_populations = current_populations.copy() # Start with current populations
-
-        # Reset transitions for this step
-        for state in all_states:
-            # Accumulate outflow for this step
-            outflow_from_state = 0 
-            # Create inflows for this step
-            inflows_to_state = {s: 0 for s in all_states}
-
-            # Calculate all transitions happening in this step
-            # A more sophisticated simulation might track individuals, not just percentages
-            # This simple model takes total population and applies probability.
-
-            # Group probabilities by source to ensure sum to 1.0
-            grouped_transitions = {}
-            for t in transitions:
-                if t["source"] not in grouped_transitions:
-                    grouped_transitions[t["source"]] = []
-                grouped_transitions[t["source"]].append(t)
-
-            for source_node, outgoing_transitions in grouped_transitions.items():
-                if current_populations[source_node] > 0:
-                    total_population_at_source = current_populations[source_node]
-
-                    # Apply probabilities for each outgoing transition
-                    for t in outgoing_transitions:
-                        target_node = t["target"]
-                        probability = t["probability"]
-
-                        # Calculate number of individuals moving
-                        num_moving = total_population_at_source * probability
-
-                        # Distribute this number
-                        inflows_to_state[target_node] += num_moving
-                        outflow_from_state += num_moving
-
-            # Apply changes to next_populations
-            for state in all_states:
-                next_populations[state] = (current_populations[state] - (outflow_from_state if state in grouped_transitions else 0)) + inflows_to_state[state]
-
-
-        current_populations = {s: round(val) for s, val in next_populations.items()} # Round to nearest integer for populations
-
-        history_data.append([step] + [current_populations[s] for s in sorted(all_states)])
-
-    columns = ['Step'] + sorted(list(all_states))
-    return pd.DataFrame(history_data, columns=columns)
\ No newline at end of file
+    # Compiled models are cached by content hash, so repeated runs skip compilation;
+    # every step is then a single vector-matrix product
+    model = compile_model(transitions, initial_population.keys(), backend)
+    steps, trace = simulate_model(model, initial_population, num_steps, checkpoints, mode, seed, use_cache, dtype)
+
+    converged = absorbed_step(trace, model.absorbing_states(), 0.5)
+    if truncate_when_absorbed and converged is not None:
+        steps, trace = steps[:converged + 1], trace[:converged + 1]
+
+    history = pd.DataFrame(trace, columns=model.states, copy=True)
+    history.insert(0, 'Step', steps)
+    history.attrs["converged_step"] = None if converged is None else int(steps[converged])
+    return history
@@ -0,0 +1,114 @@
+# simulation/sparse_matrix.py
+import numpy as np
+
+class CSRMatrix:
+    """
+    Compressed sparse row matrix stored as plain NumPy index/pointer arrays.
+    Row i's non-zeros live in data[indptr[i]:indptr[i + 1]], at columns indices[...].
+    Supports `vector @ matrix` and `batch @ matrix` with cost proportional to the
+    number of stored entries rather than n_states².
+    """
+    __slots__ = ("indptr", "indices", "data", "shape", "_rows", "_col_order", "_col_starts", "_filled_cols")
+
+    # Make ndarray @ CSRMatrix defer to __rmatmul__ instead of coercing to an object array
+    __array_ufunc__ = None
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = np.asarray(indptr, dtype=np.intp)
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.data = np.asarray(data, dtype=float)
+        self.shape = tuple(shape)
+        self._build_column_view()
+
+    @classmethod
+    def from_coo(cls, rows, cols, values, shape):
+        """Builds a CSR matrix from coordinate triplets, summing duplicate entries."""
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        values = np.asarray(values, dtype=float)
+        order = np.lexsort((cols, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+        if rows.size:
+            # Collapse runs of identical (row, col) pairs into one entry
+            new_entry = np.ones(rows.size, dtype=bool)
+            new_entry[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+            starts = np.flatnonzero(new_entry)
+            values = np.add.reduceat(values, starts)
+            rows, cols = rows[starts], cols[starts]
+        indptr = np.zeros(shape[0] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, cols, values, shape)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        """Builds a CSR matrix holding the non-zero entries of a dense array."""
+        rows, cols = np.nonzero(matrix)
+        return cls.from_coo(rows, cols, matrix[rows, cols], matrix.shape)
+
+    def _build_column_view(self):
+        # Row id of every stored entry, plus the entry order grouped by column,
+        # so products can be reduced per target column with a single reduceat
+        self._rows = np.repeat(np.arange(self.shape[0], dtype=np.intp), np.diff(self.indptr))
+        self._col_order = np.argsort(self.indices, kind="stable")
+        col_counts = np.bincount(self.indices, minlength=self.shape[1])
+        col_ptr = np.zeros(self.shape[1] + 1, dtype=np.intp)
+        np.cumsum(col_counts, out=col_ptr[1:])
+        self._filled_cols = np.flatnonzero(col_counts)
+        self._col_starts = col_ptr[self._filled_cols]
+
+    @property
+    def nnz(self):
+        return self.data.size
+
+    @property
+    def density(self):
+        return self.nnz / float(self.shape[0] * self.shape[1]) if self.shape[0] and self.shape[1] else 0.0
+
+    def entry_positions(self, rows, cols):
+        """Returns the data indices of entries (rows[i], cols[i]), or -1 where a pair is not stored."""
+        # Entries are sorted by (row, col), so their flattened keys are sorted too
+        keys = self._rows * self.shape[1] + self.indices
+        wanted = np.asarray(rows) * self.shape[1] + np.asarray(cols)
+        positions = np.searchsorted(keys, wanted)
+        found = positions < keys.size
+        found[found] = keys[positions[found]] == wanted[found]
+        return np.where(found, positions, -1)
+
+    def coo(self):
+        """Returns the (rows, cols, values) triplets of the stored entries."""
+        return self._rows, self.indices, self.data
+
+    def toarray(self):
+        dense = np.zeros(self.shape)
+        dense[self._rows, self.indices] = self.data
+        return dense
+
+    def vecmat(self, vector):
+        """Returns vector @ self for a 1-D vector of length n_rows."""
+        return np.bincount(self.indices, weights=vector[self._rows] * self.data, minlength=self.shape[1])
+
+    def matvec(self, vector):
+        """Returns self @ vector for a 1-D vector of length n_cols."""
+        return np.bincount(self._rows, weights=self.data * vector[self.indices], minlength=self.shape[0])
+
+    def matmat(self, batch):
+        """
+        Returns batch @ self for a (batch, n_rows) array.
+        Every stored entry contributes one multiply per batch row, so cost scales with edges.
+        """
+        batch = np.asarray(batch)
+        out = np.zeros((batch.shape[0], self.shape[1]), dtype=np.result_type(batch, self.data))
+        if self.nnz:
+            contributions = batch[:, self._rows[self._col_order]] * self.data[self._col_order]
+            out[:, self._filled_cols] = np.add.reduceat(contributions, self._col_starts, axis=1)
+        return out
+
+    def __rmatmul__(self, other):
+        other = np.asarray(other)
+        if other.ndim == 1:
+            return self.vecmat(other)
+        if other.ndim == 2:
+            return self.matmat(other)
+        # Stacked batches: flatten the leading axes, multiply, then restore them
+        flat = self.matmat(other.reshape(-1, other.shape[-1]))
+        return flat.reshape(other.shape[:-1] + (self.shape[1],))
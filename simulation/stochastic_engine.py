@@ -0,0 +1,50 @@
+# simulation/stochastic_engine.py
+import numpy as np
+
+from simulation.batch_engine import batch_to_frame
+from simulation.transition_matrix import (
+    build_state_index,
+    build_transition_matrix,
+    population_vector,
+)
+
+def advance_stochastic(matrix, initial_vector, num_steps, n_replicates, rng):
+    """
+    Advances whole-person cohorts with first-order (multinomial) uncertainty.
+    Each step draws every source's outflows for every replicate in a single
+    Generator.multinomial call, with the transition rows as category probabilities.
+    matrix: dense (n_states, n_states) row-stochastic matrix (a CSRMatrix is densified).
+    rng: a numpy.random.Generator.
+    Returns an int64 (n_replicates, num_steps + 1, n_states) trace.
+    """
+    if not isinstance(matrix, np.ndarray):
+        matrix = matrix.toarray()
+    # multinomial rejects rows whose probabilities overshoot 1.0 through float error
+    pvals = np.clip(matrix, 0.0, None)
+    pvals /= pvals.sum(axis=1, keepdims=True)
+
+    trace = np.empty((n_replicates, num_steps + 1, matrix.shape[0]), dtype=np.int64)
+    trace[:, 0] = np.rint(initial_vector).astype(np.int64)
+    for step in range(1, num_steps + 1):
+        # (replicates, sources) counts against (sources, targets) rows -> (replicates, sources, targets)
+        flows = rng.multinomial(trace[:, step - 1], pvals)
+        flows.sum(axis=1, out=trace[:, step])
+    return trace
+
+def run_stochastic_simulation(transitions, initial_population, num_steps, n_replicates=1, seed=None, output="frame"):
+    """
+    Runs n_replicates stochastic cohort simulations in one batched pass.
+    seed: int, SeedSequence or Generator for reproducible draws.
+    output: "frame" for a tidy Replicate/Step/State/Population DataFrame, or "array" for
+        (trace, states) with trace shaped (n_replicates, num_steps + 1, n_states).
+    """
+    rng = np.random.default_rng(seed)
+    states, state_index = build_state_index(transitions, initial_population)
+    matrix = build_transition_matrix(transitions, state_index)
+    initial_vector = population_vector(initial_population, state_index)
+    trace = advance_stochastic(matrix, initial_vector, num_steps, n_replicates, rng)
+    if output == "array":
+        return trace, states
+    if output == "frame":
+        return batch_to_frame(trace, states, batch_column='Replicate')
+    raise ValueError(f"Unknown output '{output}'.")
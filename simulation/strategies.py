@@ -0,0 +1,152 @@
+# simulation/strategies.py
+import numpy as np
+import pandas as pd
+
+from simulation.batch_engine import advance_batch
+from simulation.economics import (
+    OUTCOME_COLUMNS,
+    add_transition_costs,
+    discount_factors,
+    evaluate_payoffs,
+    payoff_matrix,
+)
+from simulation.transition_matrix import (
+    build_state_index,
+    edge_matrices,
+    population_vector,
+    transition_arrays,
+)
+
+def config_strategies(config):
+    """
+    Returns the config's strategy list, or a single "Base" strategy when it defines none.
+    Each strategy is a dict with a name and optional overrides: a list of transitions whose
+    probability (and cost) replace those of the matching source -> target transition,
+    plus optional state_costs / state_utilities that update the base values.
+    """
+    return config.get('strategies') or [{"name": "Base"}]
+
+def _shared_edges(config, strategies):
+    """Base transitions plus any edge only some strategies introduce (probability 0 elsewhere)."""
+    transitions = list(config.get('transitions', []))
+    known = {(t["source"], t["target"]) for t in transitions}
+    for strategy in strategies:
+        for t in strategy.get('overrides', []):
+            if (t["source"], t["target"]) not in known:
+                known.add((t["source"], t["target"]))
+                transitions.append({"source": t["source"], "target": t["target"], "probability": 0.0})
+    return transitions
+
+def strategy_edge_arrays(transitions, strategies, state_index):
+    """
+    Builds the shared edge structure once and returns (sources, targets, probabilities, costs),
+    where probabilities and costs are (n_strategies, n_edges) arrays with overrides applied.
+    """
+    sources, targets, base_probabilities = transition_arrays(transitions, state_index)
+    base_costs = np.fromiter((t.get("cost") or 0.0 for t in transitions), dtype=float, count=len(transitions))
+    edge_of = {}
+    for i, t in enumerate(transitions):
+        edge_of.setdefault((t["source"], t["target"]), i)
+
+    probabilities = np.tile(base_probabilities, (len(strategies), 1))
+    costs = np.tile(base_costs, (len(strategies), 1))
+    for s, strategy in enumerate(strategies):
+        for t in strategy.get('overrides', []):
+            edge = edge_of[(t["source"], t["target"])]
+            if "probability" in t:
+                probabilities[s, edge] = t["probability"]
+            if "cost" in t:
+                costs[s, edge] = t["cost"]
+    return sources, targets, probabilities, costs
+
+def incremental_analysis(outcomes, names):
+    """
+    Ranks strategies by cost and flags dominance along the cost-effectiveness frontier.
+    A strategy is "dominated" when another costs no more and yields at least as many QALYs
+    (of strategies with identical cost and QALYs only the first listed is kept), and
+    "extendedly dominated" when its ICER exceeds that of the next more effective strategy.
+    Incremental values and ICERs are against the previous non-dominated strategy.
+    """
+    table = pd.DataFrame(outcomes, columns=OUTCOME_COLUMNS)
+    table.insert(0, 'Strategy', list(names))
+    table = table.sort_values(['Cost', 'QALYs'], ascending=[True, False], kind='stable').reset_index(drop=True)
+    cost = table['Cost'].to_numpy()
+    qalys = table['QALYs'].to_numpy()
+
+    # Strong dominance: some other strategy is no more costly and no less effective, better in one
+    no_worse = (cost[None, :] <= cost[:, None]) & (qalys[None, :] >= qalys[:, None])
+    better = (cost[None, :] < cost[:, None]) | (qalys[None, :] > qalys[:, None])
+    # Exact ties are weakly dominated by the earlier (stable-sorted) copy, so the frontier
+    # never holds two points with the same QALYs and every ICER below has a non-zero denominator
+    tied = np.triu(no_worse & ~better, k=1).any(axis=0)
+    dominated = (no_worse & better).any(axis=1) | tied
+    dominance = np.where(dominated, "dominated", "").astype(object)
+
+    frontier = list(np.flatnonzero(~dominated))
+    changed = True
+    while changed and len(frontier) > 2:
+        changed = False
+        with np.errstate(divide='ignore', invalid='ignore'):
+            icers = np.diff(cost[frontier]) / np.diff(qalys[frontier])
+        for k in range(len(icers) - 1):
+            if icers[k] > icers[k + 1]:
+                dominance[frontier[k + 1]] = "extendedly dominated"
+                del frontier[k + 1]
+                changed = True
+                break
+
+    incremental_cost = np.full(len(table), np.nan)
+    incremental_qalys = np.full(len(table), np.nan)
+    icer = np.full(len(table), np.nan)
+    previous, current = np.asarray(frontier[:-1]), np.asarray(frontier[1:])
+    if current.size:
+        incremental_cost[current] = cost[current] - cost[previous]
+        incremental_qalys[current] = qalys[current] - qalys[previous]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            icer[current] = incremental_cost[current] / incremental_qalys[current]
+    table['Incremental Cost'] = incremental_cost
+    table['Incremental QALYs'] = incremental_qalys
+    table['ICER'] = icer
+    table['Dominance'] = dominance
+    return table
+
+def run_strategies(config, num_steps, initial_population=None):
+    """
+    Simulates every strategy in the config as one batched tensor and compares them.
+    The edge structure and state index are compiled once; each strategy only contributes its
+    own probability vector. initial_population defaults to initial_patients in initial_state.
+    Returns (table, trace, states): the incremental analysis DataFrame (see incremental_analysis),
+    the (n_strategies, num_steps + 1, n_states) trace, and the state order.
+    """
+    strategies = config_strategies(config)
+    if initial_population is None:
+        initial_population = {config['initial_state']: config.get('initial_patients', 1)}
+    transitions = _shared_edges(config, strategies)
+    states, state_index = build_state_index(transitions, initial_population)
+    sources, targets, probabilities, edge_costs = strategy_edge_arrays(transitions, strategies, state_index)
+
+    matrices = edge_matrices(sources, targets, probabilities, len(states))
+    trace = advance_batch(matrices, population_vector(initial_population, state_index), num_steps)
+
+    unit = config.get('timestep_unit', "Year")
+    payoffs = np.stack([
+        payoff_matrix(states,
+                      {**config.get('state_costs', {}), **strategy.get('state_costs', {})},
+                      {**config.get('state_utilities', {}), **strategy.get('state_utilities', {})},
+                      config.get('dead_states', ["Dead"]),
+                      unit)
+        for strategy in strategies
+    ])
+    if edge_costs.any():
+        n_states = len(states)
+        cost_matrices = np.zeros((len(strategies), n_states * n_states))
+        cost_matrices[:, sources * n_states + targets] = edge_costs
+        cost_matrices = cost_matrices.reshape(len(strategies), n_states, n_states)
+        payoffs = add_transition_costs(payoffs, matrices, cost_matrices)
+
+    rate = config.get('discount_rate', 0.0)
+    outcomes = evaluate_payoffs(trace, payoffs,
+                                discount_factors(num_steps, config.get('discount_rate_costs', rate), unit),
+                                discount_factors(num_steps, config.get('discount_rate_outcomes', rate), unit))
+    table = incremental_analysis(outcomes, [strategy.get('name', f"Strategy {i + 1}") for i, strategy in enumerate(strategies)])
+    return table, trace, states
@@ -0,0 +1,99 @@
+# simulation/time_varying.py
+import numpy as np
+
+from simulation.sparse_matrix import CSRMatrix
+from simulation.transition_matrix import transition_arrays, use_sparse_backend
+
+def is_time_varying(probability):
+    """True for per-cycle probability tables (lists/arrays) and functions of the cycle index."""
+    return callable(probability) or isinstance(probability, (list, tuple, np.ndarray))
+
+def has_time_varying(transitions):
+    return any(is_time_varying(t["probability"]) for t in transitions)
+
+def edge_schedule(probability, num_steps):
+    """
+    Expands one time-varying probability into a (num_steps,) array, where entry c is
+    used for the move from step c to step c + 1.
+    Tables shorter than num_steps hold their last value; functions are called once per cycle here,
+    so the engine never re-evaluates them while stepping.
+    """
+    if callable(probability):
+        return np.fromiter((probability(cycle) for cycle in range(num_steps)), dtype=float, count=num_steps)
+    table = np.asarray(probability, dtype=float)
+    if table.size == 0:
+        raise ValueError("A probability table needs at least one value.")
+    schedule = np.empty(num_steps)
+    head = min(num_steps, table.size)
+    schedule[:head] = table[:head]
+    schedule[head:] = table[-1]
+    return schedule
+
+def compile_time_varying(transitions, state_index, num_steps, backend="auto"):
+    """
+    Compiles transitions with time-varying probabilities into a base operator plus a compact
+    per-entry schedule. Only the matrix entries that change are scheduled: the off-diagonal
+    entries of varying edges and the diagonal (retained mass) of their source states, so memory
+    grows with num_steps x changing entries rather than num_steps x n_states².
+    Returns (operator, positions, values): before step s, the operator entries at positions are
+    set to values[s - 1] (see advance_cohort's schedule argument).
+    """
+    n_states = len(state_index)
+    varying = np.fromiter((is_time_varying(t["probability"]) for t in transitions), dtype=bool, count=len(transitions))
+    constant_transitions = [t for t, v in zip(transitions, varying) if not v]
+    varying_transitions = [t for t, v in zip(transitions, varying) if v]
+
+    sources, targets, probabilities = transition_arrays(constant_transitions, state_index)
+    var_sources = np.fromiter((state_index[t["source"]] for t in varying_transitions), dtype=np.intp, count=len(varying_transitions))
+    var_targets = np.fromiter((state_index[t["target"]] for t in varying_transitions), dtype=np.intp, count=len(varying_transitions))
+    series = np.empty((num_steps, len(varying_transitions)))
+    for i, t in enumerate(varying_transitions):
+        series[:, i] = edge_schedule(t["probability"], num_steps)
+
+    # Constant edges that share a (source, target) pair with a varying edge join its schedule
+    shared = np.isin(sources * n_states + targets, var_sources * n_states + var_targets)
+    var_sources = np.concatenate([var_sources, sources[shared]])
+    var_targets = np.concatenate([var_targets, targets[shared]])
+    series = np.concatenate([series, np.broadcast_to(probabilities[shared], (num_steps, int(shared.sum())))], axis=1)
+    sources, targets, probabilities = sources[~shared], targets[~shared], probabilities[~shared]
+
+    pairs, inverse = np.unique(var_sources * n_states + var_targets, return_inverse=True)
+    pair_values = np.zeros((num_steps, pairs.size))
+    np.add.at(pair_values, (slice(None), inverse), series)
+    pair_sources, pair_targets = np.divmod(pairs, n_states)
+
+    # Retained mass of every source with a varying edge, per cycle
+    affected, pair_row = np.unique(pair_sources, return_inverse=True)
+    pair_to_row = np.zeros((pairs.size, affected.size))
+    pair_to_row[np.arange(pairs.size), pair_row] = 1.0
+    constant_rowsum = np.bincount(sources, weights=probabilities, minlength=n_states)
+    self_loop = sources == targets
+    constant_diagonal = np.bincount(sources[self_loop], weights=probabilities[self_loop], minlength=n_states)
+    diagonal_pair = pair_sources == pair_targets
+    diagonal_values = (1.0 - constant_rowsum[affected] + constant_diagonal[affected]
+                       - pair_values @ pair_to_row
+                       + pair_values[:, diagonal_pair] @ pair_to_row[diagonal_pair])
+
+    entry_rows = np.concatenate([pair_sources[~diagonal_pair], affected])
+    entry_cols = np.concatenate([pair_targets[~diagonal_pair], affected])
+    values = np.concatenate([pair_values[:, ~diagonal_pair], diagonal_values], axis=1)
+
+    # Base operator: constant edges, fixed retention of untouched sources, and
+    # placeholders for every scheduled entry so the sparse structure never changes
+    unaffected = np.setdiff1d(np.arange(n_states), affected)
+    rows = np.concatenate([sources, unaffected, entry_rows])
+    cols = np.concatenate([targets, unaffected, entry_cols])
+    base_values = np.concatenate([probabilities, 1.0 - constant_rowsum[unaffected], np.zeros(entry_rows.size)])
+
+    if backend == "auto":
+        backend = "sparse" if use_sparse_backend(n_states, len(transitions)) else "dense"
+    if backend == "sparse":
+        operator = CSRMatrix.from_coo(rows, cols, base_values, (n_states, n_states))
+        positions = operator.entry_positions(entry_rows, entry_cols)
+    elif backend == "dense":
+        operator = np.zeros((n_states, n_states))
+        np.add.at(operator, (rows, cols), base_values)
+        positions = entry_rows * n_states + entry_cols
+    else:
+        raise ValueError(f"Unknown matrix backend '{backend}'.")
+    return operator, positions, values
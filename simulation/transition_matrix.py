@@ -0,0 +1,167 @@
+# simulation/transition_matrix.py
+import numpy as np
+
+from simulation.allocation import IntegerAllocator
+from simulation.sparse_matrix import CSRMatrix
+
+# The sparse backend is used automatically for models at least this large whose
+# stored entries (transitions plus retained mass) fill less than this share of the matrix
+SPARSE_MIN_STATES = 128
+SPARSE_MAX_DENSITY = 0.05
+
+def build_state_index(transitions, initial_population):
+    """
+    Collects every state named in the transitions or the initial population.
+    Returns the sorted state list and a dict mapping each state to its column index.
+    """
+    all_states = set(initial_population.keys())
+    for t in transitions:
+        all_states.add(t["source"])
+        all_states.add(t["target"])
+    states = sorted(all_states)
+    return states, {state: i for i, state in enumerate(states)}
+
+def transition_arrays(transitions, state_index):
+    """Returns the source indices, target indices and probabilities of the transitions as arrays."""
+    count = len(transitions)
+    sources = np.fromiter((state_index[t["source"]] for t in transitions), dtype=np.intp, count=count)
+    targets = np.fromiter((state_index[t["target"]] for t in transitions), dtype=np.intp, count=count)
+    probabilities = np.fromiter((t["probability"] for t in transitions), dtype=float, count=count)
+    return sources, targets, probabilities
+
+def build_transition_matrix(transitions, state_index):
+    """
+    Builds a dense (n_states, n_states) matrix where row i holds the probability of
+    moving from state i to every other state in one step.
+    Probability mass a source does not hand out (rows summing below 1.0, or states
+    with no outgoing transitions) stays in the source state.
+    """
+    n_states = len(state_index)
+    matrix = np.zeros((n_states, n_states))
+    sources, targets, probabilities = transition_arrays(transitions, state_index)
+    # add.at so duplicate source/target pairs accumulate instead of overwriting
+    np.add.at(matrix, (sources, targets), probabilities)
+    matrix[np.diag_indices(n_states)] += 1.0 - matrix.sum(axis=1)
+    return matrix
+
+def edge_matrices(sources, targets, edge_probabilities, n_states):
+    """
+    Scatters a (batch, n_edges) block of edge probabilities into a (batch, n_states, n_states)
+    stack of transition matrices sharing one edge structure, with retained mass on the diagonal.
+    """
+    batch = edge_probabilities.shape[0]
+    matrices = np.zeros((batch, n_states * n_states))
+    flat_index = sources * n_states + targets
+    if np.unique(flat_index).size == flat_index.size:
+        matrices[:, flat_index] = edge_probabilities
+    else:
+        np.add.at(matrices, (slice(None), flat_index), edge_probabilities)
+    matrices = matrices.reshape(batch, n_states, n_states)
+    diagonal = np.arange(n_states)
+    matrices[:, diagonal, diagonal] += 1.0 - matrices.sum(axis=2)
+    return matrices
+
+def build_sparse_transition_matrix(transitions, state_index):
+    """Sparse counterpart of build_transition_matrix, built without a dense intermediate."""
+    n_states = len(state_index)
+    sources, targets, probabilities = transition_arrays(transitions, state_index)
+    retained = 1.0 - np.bincount(sources, weights=probabilities, minlength=n_states)
+    keep = np.flatnonzero(retained)
+    rows = np.concatenate([sources, keep])
+    cols = np.concatenate([targets, keep])
+    values = np.concatenate([probabilities, retained[keep]])
+    return CSRMatrix.from_coo(rows, cols, values, (n_states, n_states))
+
+def use_sparse_backend(n_states, n_transitions):
+    """Decides whether a model is large and sparse enough for the CSR backend."""
+    if n_states < SPARSE_MIN_STATES:
+        return False
+    # Every state may also keep a diagonal retention entry
+    return (n_transitions + n_states) / float(n_states * n_states) <= SPARSE_MAX_DENSITY
+
+def build_transition_operator(transitions, state_index, backend="auto"):
+    """
+    Builds the one-step transition operator with the requested backend.
+    backend: "dense", "sparse", or "auto" to pick sparse for large, low-density models.
+    """
+    if backend == "auto":
+        backend = "sparse" if use_sparse_backend(len(state_index), len(transitions)) else "dense"
+    if backend == "sparse":
+        return build_sparse_transition_matrix(transitions, state_index)
+    if backend == "dense":
+        return build_transition_matrix(transitions, state_index)
+    raise ValueError(f"Unknown matrix backend '{backend}'.")
+
+def population_vector(initial_population, state_index):
+    """Converts a {state: count} dict into a vector ordered by state_index."""
+    vector = np.zeros(len(state_index))
+    for state, count in initial_population.items():
+        vector[state_index[state]] = count
+    return vector
+
+def advance_cohort(matrix, initial_vector, num_steps, round_counts=True, schedule=None, integer=False):
+    """
+    Advances a cohort num_steps times with one vector-matrix product per step.
+    matrix may be a dense array or a CSRMatrix.
+    schedule: Optional (positions, values) pair for time-varying models; before step s the
+        matrix entries at positions (flat indices, or CSR data indices) are set to values[s - 1].
+    Returns a preallocated (num_steps + 1, n_states) trace whose row 0 is the initial vector.
+    round_counts rounds every step to whole people, matching the original engine. Rounding each
+        state on its own can create or lose people; integer allocates each source's outflow
+        with IntegerAllocator instead, so the population total is conserved exactly.
+    """
+    trace = np.empty((num_steps + 1, matrix.shape[0]))
+    trace[0] = np.rint(initial_vector) if integer else initial_vector
+    if schedule is not None:
+        positions, values = schedule
+        # Patch a private copy so the caller's compiled operator stays untouched
+        if isinstance(matrix, np.ndarray):
+            matrix = matrix.copy()
+            entries = matrix.reshape(-1)
+        else:
+            matrix = CSRMatrix(matrix.indptr, matrix.indices, matrix.data.copy(), matrix.shape)
+            entries = matrix.data
+    if integer:
+        allocator = IntegerAllocator(matrix)
+    for step in range(1, num_steps + 1):
+        if schedule is not None:
+            entries[positions] = values[step - 1]
+        if integer:
+            trace[step] = allocator.step(trace[step - 1])
+            continue
+        if isinstance(matrix, np.ndarray):
+            np.matmul(trace[step - 1], matrix, out=trace[step])
+        else:
+            trace[step] = trace[step - 1] @ matrix
+        if round_counts:
+            np.rint(trace[step], out=trace[step])
+    return trace
+
+def checkpoint_distributions(matrix, initial_vector, checkpoints):
+    """
+    Returns the cohort at each requested step without iterating every cycle.
+    The gap between consecutive checkpoints is applied by exponentiation by squaring,
+    so reaching step N costs O(log N) matrix products. Squared powers are kept and
+    reused across gaps. checkpoints must be sorted, unique, non-negative integers.
+    Values are expected counts; no per-step rounding is applied.
+    """
+    if not isinstance(matrix, np.ndarray):
+        # Powers of a sparse chain fill in quickly, so square the dense form
+        matrix = matrix.toarray()
+    results = np.empty((len(checkpoints), matrix.shape[0]))
+    powers = [matrix]  # powers[k] holds matrix ** (2 ** k)
+    current = np.asarray(initial_vector, dtype=float)
+    previous = 0
+    for row, checkpoint in enumerate(checkpoints):
+        gap = checkpoint - previous
+        bit = 0
+        while gap:
+            if bit == len(powers):
+                powers.append(powers[-1] @ powers[-1])
+            if gap & 1:
+                current = current @ powers[bit]
+            gap >>= 1
+            bit += 1
+        results[row] = current
+        previous = checkpoint
+    return results
@@ -0,0 +1,46 @@
+# tests/test_psa.py
+import numpy as np
+import pytest
+
+from simulation.psa import run_psa, sample_transition_matrices
+from simulation.transition_matrix import build_state_index
+
+def _matrices(transitions, n_iterations=200):
+    states, state_index = build_state_index(transitions, {"Healthy": 1})
+    matrices = sample_transition_matrices(transitions, state_index, n_iterations, np.random.default_rng(0))
+    return matrices, state_index
+
+def test_beta_draw_leaves_fixed_edges_alone():
+    transitions = [
+        {"source": "Healthy", "target": "Sick", "probability": 0.1,
+         "distribution": {"type": "beta", "alpha": 10, "beta": 90}},
+        {"source": "Healthy", "target": "Dead", "probability": 0.01},
+    ]
+    matrices, index = _matrices(transitions)
+    healthy, sick, dead = index["Healthy"], index["Sick"], index["Dead"]
+    assert np.all(matrices[:, healthy, dead] == 0.01)
+    np.testing.assert_allclose(matrices[:, healthy, healthy], 1.0 - 0.01 - matrices[:, healthy, sick])
+    np.testing.assert_allclose(matrices.sum(axis=2), 1.0)
+
+def test_explicit_self_loop_is_the_residual():
+    transitions = [
+        {"source": "Healthy", "target": "Healthy", "probability": 0.89},
+        {"source": "Healthy", "target": "Sick", "probability": 0.1,
+         "distribution": {"type": "beta", "alpha": 10, "beta": 90}},
+        {"source": "Healthy", "target": "Dead", "probability": 0.01,
+         "distribution": {"type": "beta", "alpha": 1, "beta": 99}},
+    ]
+    matrices, index = _matrices(transitions)
+    assert (matrices >= 0).all()
+    np.testing.assert_allclose(matrices.sum(axis=2), 1.0)
+    trace, _ = run_psa(transitions, {"Healthy": 1000}, 5, 10, seed=1)
+    assert (trace >= 0).all()
+
+def test_off_diagonal_draws_above_one_raise():
+    transitions = [
+        {"source": "Healthy", "target": "Sick", "probability": 0.7,
+         "distribution": {"type": "beta", "alpha": 70, "beta": 30}},
+        {"source": "Healthy", "target": "Dead", "probability": 0.3},
+    ]
+    with pytest.raises(ValueError, match="exceed 1.0"):
+        _matrices(transitions)
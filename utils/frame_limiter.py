@@ -0,0 +1,45 @@
+# utils/frame_limiter.py
+import time
+
+DEFAULT_MAX_FPS = 5
+
+class FrameLimiter:
+    """
+    Caps how often a live view is redrawn to a frames-per-second budget.
+    Frames offered faster than the budget are coalesced: only the newest one is kept
+    pending, and flush() draws it, so the final state is always shown.
+    """
+    def __init__(self, render, max_fps=DEFAULT_MAX_FPS, clock=time.monotonic):
+        """
+        render: Callable drawing one frame.
+        max_fps: Most redraws per second; 0 or None draws every frame.
+        """
+        self.render = render
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.clock = clock
+        self.rendered = 0
+        self.dropped = 0
+        self._next_time = None
+        self._pending = None
+
+    def offer(self, frame):
+        """Draws frame if the budget allows, otherwise holds it until it is superseded or flushed."""
+        if self._pending is not None:
+            self.dropped += 1  # superseded before it was drawn
+            self._pending = None
+        now = self.clock()
+        if self._next_time is None or now >= self._next_time:
+            self._draw(frame, now)
+        else:
+            self._pending = frame
+
+    def flush(self):
+        """Draws the last held-back frame, if any."""
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+            self._draw(frame, self.clock())
+
+    def _draw(self, frame, now):
+        self.render(frame)
+        self.rendered += 1
+        self._next_time = now + self.interval